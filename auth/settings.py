@@ -58,15 +58,21 @@ INSTALLED_APPS = [
     # 'drf_spectacular__sidecar',
 ]
 
+# The Scoped* middleware only run outside API_PATH_PREFIX (i.e. for /admin/);
+# JWT-authenticated /api/ requests skip sessions, CSRF, messages and X-Frame-Options
+API_PATH_PREFIX = "/api/"
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "users.middleware.ProfilingMiddleware",
+    "users.middleware.CompressionMiddleware",
+    "users.middleware.ScopedSessionMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
-    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "users.middleware.ScopedCsrfViewMiddleware",
+    "users.middleware.ScopedAuthenticationMiddleware",
+    "users.middleware.ScopedMessageMiddleware",
+    "users.middleware.ScopedXFrameOptionsMiddleware",
 ]
 
 # AUTH_USER_MODEL = "drf_user.CustomUser"
@@ -97,6 +103,12 @@ SPECTACULAR_SETTINGS = {
     # OTHER SETTINGS
 }
 
+# Prebuilt schema location (`python manage.py build_openapi_schema`) and the code
+# version it is keyed on; a new deploy commit invalidates the cached schema. When
+# unset, the version is a digest of the project's sources (users/schema.py).
+OPENAPI_SCHEMA_DIR = BASE_DIR / "openapi"
+SCHEMA_CODE_VERSION = os.getenv("CODE_VERSION") or os.getenv("RENDER_GIT_COMMIT")
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -121,6 +133,8 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.TokenRefreshSerializer',
     
     # Cookie settings
     'AUTH_COOKIE_ACCESS': 'access_token',
@@ -133,6 +147,51 @@ SIMPLE_JWT = {
     'AUTH_COOKIE_DOMAIN': None,
 }
 
+# Outbox: "sync" applies rating side effects inside the request,
+# "deferred" queues them for `python manage.py run_outbox_worker`
+OUTBOX_MODE = os.getenv("OUTBOX_MODE", "sync")
+
+# Number of counter shards per movie for rating writes; 0 updates the movie row directly.
+# Shards are folded into the movie stats by the outbox worker.
+RATING_COUNTER_SHARDS = int(os.getenv("RATING_COUNTER_SHARDS", 0))
+
+# Per-worker columnar movie snapshot answering list_movies filters/sorts in memory
+# (users/catalog.py); needs numpy. Costs each worker roughly 32 bytes per movie,
+# plus 8 per movie for each sort order in use.
+MOVIE_CATALOG = {
+    "ENABLED": os.getenv("MOVIE_CATALOG_ENABLED", "false").lower() == "true",
+    "REFRESH_INTERVAL": int(os.getenv("MOVIE_CATALOG_REFRESH_INTERVAL", 2)),
+    "FULL_REFRESH_INTERVAL": int(os.getenv("MOVIE_CATALOG_FULL_REFRESH_INTERVAL", 300)),
+}
+
+# Half-life of a rating's weight in the trending feed (users/trending.py)
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", 24))
+
+# Staff-only request profiling (users/middleware.py ProfilingMiddleware): send
+# "X-Profile: 1" or "?_profile=1"; runs are listed at /api/system/profiles/
+PROFILING = {
+    "DIR": os.getenv("PROFILING_DIR", str(BASE_DIR / "profiles")),
+    "KEEP": int(os.getenv("PROFILING_KEEP", 200)),
+}
+
+# Ratings removed per transaction when a movie or user is deleted (users/deletion.py)
+RATING_DELETE_CHUNK_SIZE = int(os.getenv("RATING_DELETE_CHUNK_SIZE", 1000))
+
+# PostgreSQL only: hash-partition users_rating by movie into this many partitions
+# (users/partitioning.py); 0 keeps a single table. Applied by running
+# "manage.py partition_ratings" after migrate, never by migrations.
+RATING_PARTITIONS = int(os.getenv("RATING_PARTITIONS", 0))
+
+# Refresh-token blacklist front (users/blacklist.py). Lookups skip the database only
+# with a shared (non-locmem) cache; BATCH_SIZE and FLUSH_INTERVAL batch outstanding-token
+# rows, revocations are always written immediately. Purge expired rows with
+# `python manage.py purge_expired_tokens` from cron or with --every
+JWT_BLACKLIST = {
+    'REFRESH_INTERVAL': 5,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1,
+}
+
 # CORS settings
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOWED_ORIGINS = [
@@ -162,6 +221,43 @@ else:
         'default':dj_database_url.parse(os.getenv("DATABASE_URL"))
     }
 
+# Response compression (users/middleware.py), applied under API_PATH_PREFIX only.
+# Auth responses carry tokens next to user-supplied input, so they are never
+# compressed either (BREACH).
+COMPRESSION = {
+    "MIN_SIZE": 1024,
+    "GZIP_LEVEL": 1,
+    "BROTLI_QUALITY": 4,
+    "EXCLUDE_PATHS": ["/api/auth/"],
+}
+
+# Cache: shared Redis when REDIS_URL is set, otherwise per-process memory
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+
+# Movie object cache (users/cache.py): per-worker LRU in front of the shared cache
+MOVIE_CACHE = {
+    "MAX_ENTRIES": int(os.getenv("MOVIE_CACHE_MAX_ENTRIES", 1024)),
+    "LOCAL_TTL": int(os.getenv("MOVIE_CACHE_LOCAL_TTL", 5)),
+    "SHARED_TTL": int(os.getenv("MOVIE_CACHE_SHARED_TTL", 300)),
+}
+
+# Single-flight reads (users/singleflight.py) for list_movies, trending and movie detail.
+# Concurrent identical requests in a worker always share one set of queries. TTL > 0
+# also caches the results for TTL seconds, then serves them stale for GRACE more
+# seconds while one request refreshes them. LOCK_TIMEOUT > 0 extends the
+# coalescing across workers through a lock key in the shared (Redis) cache.
+SINGLE_FLIGHT = {
+    "TTL": int(os.getenv("SINGLE_FLIGHT_TTL", 0)),
+    "GRACE": int(os.getenv("SINGLE_FLIGHT_GRACE", 0)),
+    "LOCK_TIMEOUT": int(os.getenv("SINGLE_FLIGHT_LOCK_TIMEOUT", 0)),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
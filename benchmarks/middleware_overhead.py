@@ -0,0 +1,70 @@
+"""
+Per-request cost of the full middleware stack vs the API-scoped one.
+
+Runs health_check and list_movies through Django's full request handler with
+the original MIDDLEWARE list and with the current (scoped) settings, against
+whatever database DATABASE_URL points at:
+
+    DATABASE_URL=sqlite:///db.sqlite3 python benchmarks/middleware_overhead.py --requests 2000
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "auth.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+
+FULL_STACK = [
+    "corsheaders.middleware.CorsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "users.middleware.CompressionMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+ENDPOINTS = {
+    "health_check": "/api/",
+    "list_movies": "/api/movies/?limit=10",
+}
+
+
+def per_request_us(path, requests):
+    client = Client(HTTP_HOST="localhost")
+    for _ in range(50):  # warm up the handler, url resolver and connection
+        client.get(path)
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    for name, path in ENDPOINTS.items():
+        with override_settings(MIDDLEWARE=FULL_STACK):
+            full = per_request_us(path, args.requests)
+        with override_settings(MIDDLEWARE=settings.MIDDLEWARE):
+            scoped = per_request_us(path, args.requests)
+        print(f"{name:>13}: full {full:8.1f} us  scoped {scoped:8.1f} us  saved {full - scoped:7.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
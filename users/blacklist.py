@@ -0,0 +1,232 @@
+"""
+Refresh-token blacklist with an in-memory front and batched outstanding rows.
+
+simplejwt's blacklist app does an indexed lookup on every refresh and inserts
+OutstandingToken/BlacklistedToken rows one at a time. Here a revocation is
+still written to BlacklistedToken before the rotating or logout request
+returns, so other workers and restarts see it, but lookups avoid the
+database: each worker keeps a Bloom filter of blacklisted JTIs, refreshed
+incrementally every REFRESH_INTERVAL seconds, and the shared cache carries
+revocations made since then. The database is consulted only when the filter
+reports a possible hit. A process-local cache cannot cover that refresh window
+for other workers, so without a shared cache every lookup reads the database.
+
+Only OutstandingToken rows, the record of issued tokens, are buffered and
+written with bulk_create every BATCH_SIZE tokens or FLUSH_INTERVAL seconds.
+
+Expired rows are removed in chunks by ``manage.py purge_expired_tokens``.
+"""
+import atexit
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+
+DEFAULTS = {
+    'BLOOM_BITS': 1 << 23,  # 1 MiB, ~1% false positives at 870k entries with 7 hashes
+    'BLOOM_HASHES': 7,
+    'REFRESH_INTERVAL': 5,
+    'REBUILD_INTERVAL': 3600,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1,
+}
+
+
+class BloomFilter:
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray(bits // 8 + 1)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self.array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class TokenBlacklist:
+    cache_prefix = 'jwt-blacklist:'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._high_water = 0
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self._pending_outstanding = {}
+        self._flushed_at = time.monotonic()
+
+    @property
+    def options(self):
+        return {**DEFAULTS, **getattr(settings, 'JWT_BLACKLIST', {})}
+
+    @property
+    def shared_cache(self):
+        # Entries in a process-local cache are invisible to the other workers
+        cache = caches['default']
+        return None if isinstance(cache, (LocMemCache, DummyCache)) else cache
+
+    # Lookups
+
+    def contains(self, jti):
+        self._maybe_flush()
+        shared = self.shared_cache
+        if shared is None:
+            return self._in_database(jti)
+        if shared.get(self.cache_prefix + jti) is not None:
+            return True
+        self._sync()
+        if jti in self._bloom:
+            # Possible hit (or false positive); the database decides
+            return self._in_database(jti)
+        return False
+
+    def _in_database(self, jti):
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def _sync(self):
+        options = self.options
+        now = time.monotonic()
+        if self._bloom is None or now - self._rebuilt_at > options['REBUILD_INTERVAL']:
+            self._rebuild()
+        elif now - self._refreshed_at > options['REFRESH_INTERVAL']:
+            self._load_new()
+
+    def _rebuild(self):
+        options = self.options
+        bloom = BloomFilter(options['BLOOM_BITS'], options['BLOOM_HASHES'])
+        rows = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list('id', 'token__jti')
+        high_water = 0
+        for row_id, jti in rows.iterator(chunk_size=10000):
+            bloom.add(jti)
+            high_water = max(high_water, row_id)
+        with self._lock:
+            # A revocation committed while this ran is above high_water, so the next _load_new adds it
+            self._bloom = bloom
+            self._high_water = high_water
+            self._rebuilt_at = self._refreshed_at = time.monotonic()
+
+    def _load_new(self):
+        rows = BlacklistedToken.objects.filter(id__gt=self._high_water).values_list('id', 'token__jti')
+        with self._lock:
+            for row_id, jti in rows:
+                self._bloom.add(jti)
+                self._high_water = max(self._high_water, row_id)
+            self._refreshed_at = time.monotonic()
+
+    # Writes
+
+    def outstand(self, token, user_id):
+        with self._lock:
+            self._pending_outstanding[token[api_settings.JTI_CLAIM]] = self._row(token, user_id)
+        self._maybe_flush()
+
+    def add(self, token):
+        """Blacklist ``token`` in the database now; callers rely on it being revoked everywhere"""
+        jti = token[api_settings.JTI_CLAIM]
+        with self._lock:
+            # Written below together with its blacklist row
+            self._pending_outstanding.pop(jti, None)
+        row = self._row(token, token.get(api_settings.USER_ID_CLAIM))
+        row['user_id'] = self._existing_user_ids([row]).get(str(row['user_id']))
+        with transaction.atomic():
+            outstanding, _ = OutstandingToken.objects.get_or_create(jti=jti, defaults=row)
+            BlacklistedToken.objects.get_or_create(token=outstanding)
+
+        shared = self.shared_cache
+        if shared is not None:
+            shared.set(self.cache_prefix + jti, 1, max(int(token['exp'] - time.time()), 1))
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+
+    def _row(self, token, user_id):
+        return {
+            'jti': token[api_settings.JTI_CLAIM],
+            'token': str(token),
+            'user_id': user_id,
+            'created_at': token.current_time,
+            'expires_at': datetime_from_epoch(token['exp']),
+        }
+
+    def _existing_user_ids(self, rows):
+        """Map each row's user id claim to the user's pk, skipping users deleted since the token was issued"""
+        claims = {row['user_id'] for row in rows if row['user_id'] is not None}
+        if not claims:
+            return {}
+        pks = get_user_model().objects.filter(
+            **{f'{api_settings.USER_ID_FIELD}__in': claims}
+        ).values_list(api_settings.USER_ID_FIELD, 'pk')
+        return {str(claim): pk for claim, pk in pks}
+
+    def _maybe_flush(self):
+        options = self.options
+        if not self._pending_outstanding:
+            return
+        if (
+            len(self._pending_outstanding) >= options['BATCH_SIZE']
+            or time.monotonic() - self._flushed_at > options['FLUSH_INTERVAL']
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write buffered outstanding tokens with a fixed number of queries"""
+        with self._lock:
+            outstanding = self._pending_outstanding
+            self._pending_outstanding = {}
+            self._flushed_at = time.monotonic()
+        if not outstanding:
+            return
+
+        users = self._existing_user_ids(outstanding.values())
+        OutstandingToken.objects.bulk_create(
+            [OutstandingToken(**{**row, 'user_id': users.get(str(row['user_id']))}) for row in outstanding.values()],
+            ignore_conflicts=True,
+        )
+
+
+token_blacklist = TokenBlacklist()
+atexit.register(token_blacklist.flush)
+
+
+class BlacklistedRefreshToken(RefreshToken):
+    """RefreshToken whose blacklist checks and writes go through ``token_blacklist``"""
+
+    @classmethod
+    def for_user(cls, user):
+        # Skip BlacklistMixin.for_user, which inserts the OutstandingToken row immediately
+        token = super(BlacklistMixin, cls).for_user(user)
+        token_blacklist.outstand(token, user.pk)
+        return token
+
+    def check_blacklist(self):
+        if token_blacklist.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        token_blacklist.add(self)
+
+    def outstand(self):
+        token_blacklist.outstand(self, self.payload.get(api_settings.USER_ID_CLAIM))
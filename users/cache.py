@@ -0,0 +1,165 @@
+"""
+Two-tier cache-aside store for Movie rows keyed by id.
+
+Tier one is a bounded LRU inside each worker process; entries live for
+``LOCAL_TTL`` seconds so other workers' writes become visible quickly. Tier two
+is the shared Django cache (skipped when that cache is process-local anyway),
+which holds plain column values. A movie's creator is loaded and cached with
+its id and username only, so no user row (or password hash) reaches Redis.
+Writes go through ``invalidate()``, which Movie.save/delete and the rating
+aggregate updates call once their transaction commits. Concurrent misses for
+one movie are coalesced into a single query (users/singleflight.py).
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .singleflight import read_flight
+
+
+# Creator columns cached with a movie; MovieSerializer shows created_by and created_by_username
+CREATOR_FIELDS = ('id', 'username')
+
+DEFAULTS = {
+    'MAX_ENTRIES': 1024,
+    'LOCAL_TTL': 5,
+    'SHARED_TTL': 300,
+    'SHARED_ALIAS': 'default',
+}
+
+
+class MovieCache:
+    # Shared entries are dicts from _to_shared(); bump the version when their layout or Movie's columns change
+    key_prefix = 'movie:v3:'
+
+    def __init__(self):
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ['local_hits', 'shared_hits', 'misses', 'evictions', 'invalidations'], 0
+        )
+
+    @property
+    def options(self):
+        return {**DEFAULTS, **getattr(settings, 'MOVIE_CACHE', {})}
+
+    @property
+    def shared(self):
+        cache = caches[self.options['SHARED_ALIAS']]
+        # A locmem "shared" tier is private to this process and could not be invalidated by other workers
+        return None if isinstance(cache, LocMemCache) else cache
+
+    @staticmethod
+    def _query(movie_id):
+        """The visible movie; of its creator only the id and username are loaded"""
+        from .models import Movie
+
+        fields = [field.name for field in Movie._meta.concrete_fields]
+        return (
+            Movie.objects.visible().select_related('created_by')
+            .only(*fields, *(f'created_by__{name}' for name in CREATOR_FIELDS))
+            .get(id=movie_id)
+        )
+
+    @staticmethod
+    def _to_shared(movie):
+        """Plain column values for the shared tier, which never holds user rows"""
+        return {
+            'movie': {field.attname: getattr(movie, field.attname) for field in movie._meta.concrete_fields},
+            'created_by': {name: getattr(movie.created_by, name) for name in CREATOR_FIELDS},
+        }
+
+    @staticmethod
+    def _from_shared(data):
+        from .models import CustomUser, Movie
+
+        movie = Movie.from_db(Movie.objects.db, list(data['movie']), list(data['movie'].values()))
+        movie.created_by = CustomUser.from_db(
+            CustomUser.objects.db, list(data['created_by']), list(data['created_by'].values())
+        )
+        return movie
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, movie_id):
+        """Return a copy of the visible Movie with ``movie_id``; raises Movie.DoesNotExist"""
+        movie_id = int(movie_id)
+        options = self.options
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(movie_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._local.move_to_end(movie_id)
+                    self._counters['local_hits'] += 1
+                    return copy.copy(entry[1])
+                del self._local[movie_id]
+
+        shared = self.shared
+        key = self.key_prefix + str(movie_id)
+        data = shared.get(key) if shared is not None else None
+        if data is not None:
+            self._count('shared_hits')
+            movie = self._from_shared(data)
+        else:
+            self._count('misses')
+
+            def load():
+                movie = self._query(movie_id)
+                if shared is not None:
+                    shared.set(key, self._to_shared(movie), options['SHARED_TTL'])
+                return movie
+
+            def poll():
+                data = shared.get(key)
+                return None if data is None else self._from_shared(data)
+
+            def fill():
+                # Another worker loading the same movie fills the shared tier; wait for that instead
+                return read_flight.run_exclusive(shared, key, load, poll)
+
+            # Concurrent misses for one movie (say, right after an invalidation) share a single query
+            movie = read_flight.run(key, fill if shared is not None else load)
+
+        with self._lock:
+            self._local[movie_id] = (now + options['LOCAL_TTL'], movie)
+            self._local.move_to_end(movie_id)
+            while len(self._local) > options['MAX_ENTRIES']:
+                self._local.popitem(last=False)
+                self._counters['evictions'] += 1
+        return copy.copy(movie)
+
+    def invalidate(self, *movie_ids):
+        with self._lock:
+            for movie_id in movie_ids:
+                self._local.pop(int(movie_id), None)
+            self._counters['invalidations'] += len(movie_ids)
+        shared = self.shared
+        if shared is not None:
+            shared.delete_many([self.key_prefix + str(movie_id) for movie_id in movie_ids])
+
+    def invalidate_on_commit(self, *movie_ids):
+        transaction.on_commit(lambda: self.invalidate(*movie_ids))
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['local_hits'] + self._counters['shared_hits'] + self._counters['misses']
+            hits = lookups - self._counters['misses']
+            return {
+                **self._counters,
+                'size': len(self._local),
+                'max_entries': self.options['MAX_ENTRIES'],
+                'hit_ratio': round(hits / lookups, 4) if lookups else None,
+                'shared_tier': self.shared is not None,
+            }
+
+
+movie_cache = MovieCache()
@@ -0,0 +1,291 @@
+"""
+Per-worker columnar snapshot of the movie catalog for list_movies.
+
+With ``MOVIE_CATALOG["ENABLED"]`` (and numpy installed) each worker keeps the
+visible movies' id, genre, release_year, ratings_avg, ratings_count and
+created_at in numpy arrays sorted by id. A list_movies call without ``search``
+and with a numeric sort is answered by boolean masks over those arrays and a
+cached sort permutation; only the requested page is loaded from the database,
+by primary key.
+
+The snapshot catches up every REFRESH_INTERVAL seconds by reading movies whose
+updated_at is past the start of the previous refresh (minus OVERLAP seconds,
+for writes that committed late or on a skewed clock), and is rebuilt every FULL_REFRESH_INTERVAL seconds to drop
+movies deleted outright. Until then a deleted movie only shortens its page.
+That rebuild runs on a background thread and swaps the new snapshot in when
+done; requests keep reading the previous one meanwhile, and it keeps catching
+up as usual. Before the swap the rebuilt snapshot catches up on the writes
+made since its build began, so none of them is lost with the old snapshot.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; without it list_movies always runs in SQL
+    np = None
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'REFRESH_INTERVAL': 2,
+    'FULL_REFRESH_INTERVAL': 300,
+    'OVERLAP': 5,
+}
+
+COLUMNS = ('id', 'genre', 'release_year', 'ratings_avg', 'ratings_count', 'created_at')
+
+# Sort keys per list_movies ?sort=, most significant last (np.lexsort order).
+# All orders are descending and end in -id, like views.MOVIE_SORT_ORDERS.
+SORT_KEYS = {
+    'rating': ('id', 'created_at', 'ratings_avg'),
+    'count': ('id', 'ratings_count'),
+    'newest': ('id', 'created_at'),
+    'year': ('id', 'release_year'),
+}
+
+
+class Snapshot:
+    """Immutable set of column arrays plus lazily computed sort permutations"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._orders = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.columns.values()) + sum(
+            order.nbytes for order in self._orders.values()
+        )
+
+    def order(self, sort):
+        perm = self._orders.get(sort)
+        if perm is None:
+            with self._lock:
+                perm = self._orders.get(sort)
+                if perm is None:
+                    keys = [self.columns[name] for name in SORT_KEYS[sort]]
+                    perm = np.lexsort(keys)[::-1].copy()
+                    self._orders[sort] = perm
+        return perm
+
+
+class CatalogResult:
+    """
+    Lazily hydrated, ordered result that Django's Paginator can page through.
+    Slicing loads just the sliced movies from ``queryset`` by id.
+    """
+
+    def __init__(self, ids, queryset):
+        self.ids = ids
+        self.queryset = queryset
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        ids = [int(movie_id) for movie_id in np.atleast_1d(self.ids[index])]
+        movies = self.queryset.in_bulk(ids)
+        page = [movies[movie_id] for movie_id in ids if movie_id in movies]
+        return page if isinstance(index, slice) else page[0]
+
+
+class MovieCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._high_water = None
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self._rebuilding = False
+        self._generation = 0
+
+    @property
+    def options(self):
+        return {**DEFAULTS, **getattr(settings, 'MOVIE_CATALOG', {})}
+
+    def is_enabled(self):
+        return np is not None and self.options['ENABLED']
+
+    def supports(self, sort, search):
+        return self.is_enabled() and not search and sort in SORT_KEYS
+
+    # Queries
+
+    def select(self, queryset, sort, genre=None, ranges=()):
+        """
+        Movies matching ``genre`` (case-insensitive) and ``ranges`` of
+        ``(field, 'gte'|'lte', value)`` in ``sort`` order, as a CatalogResult
+        that hydrates pages from ``queryset``.
+        """
+        snapshot = self._sync()
+        columns = snapshot.columns
+        mask = None
+
+        def narrow(condition):
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+
+        if genre:
+            from .models import Movie
+            narrow(columns['genre'] == (Movie.Genre.from_label(genre) or 0))
+        for field, lookup, value in ranges:
+            narrow(columns[field] >= value if lookup == 'gte' else columns[field] <= value)
+
+        order = snapshot.order(sort)
+        rows = order if mask is None else order[mask[order]]
+        return CatalogResult(columns['id'][rows], queryset)
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'enabled': self.is_enabled(),
+            'movies': len(snapshot) if snapshot is not None else 0,
+            'bytes': snapshot.nbytes if snapshot is not None else 0,
+            'high_water': self._high_water.isoformat() if self._high_water else None,
+        }
+
+    # Refresh
+
+    def invalidate(self):
+        """Drop the snapshot; the next query rebuilds it"""
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+    def _sync(self):
+        options = self.options
+        now = time.monotonic()
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._install(self._generation, *self._build())
+            return self._snapshot
+        if now - self._rebuilt_at > options['FULL_REFRESH_INTERVAL']:
+            self.start_rebuild()
+        # A rebuild can take a while; keep catching up on the current snapshot until it lands
+        if now - self._refreshed_at > options['REFRESH_INTERVAL']:
+            with self._lock:
+                if now - self._refreshed_at > options['REFRESH_INTERVAL']:
+                    self._load_changes()
+        return self._snapshot
+
+    def start_rebuild(self):
+        """Rebuild on a background thread unless one is running; returns the thread or None"""
+        if self._rebuilding:
+            return None
+        with self._lock:
+            if self._rebuilding:
+                return None
+            self._rebuilding = True
+            generation = self._generation
+        thread = threading.Thread(
+            target=self._rebuild_in_background, args=(generation,), name='movie-catalog-rebuild', daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _rebuild_in_background(self, generation):
+        try:
+            snapshot, high_water, started = self._build()
+            # Apply what was written while the build read the table, outside the lock
+            snapshot, high_water, refreshed_at = self._catch_up(snapshot, high_water)
+            with self._lock:
+                self._install(generation, snapshot, high_water, started, refreshed_at)
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def _rows(self, queryset):
+        for *row, created in queryset.values_list(*COLUMNS).iterator(chunk_size=10000):
+            yield *row, int(created.timestamp() * 1e6)
+
+    def _arrays(self, rows):
+        return {
+            'id': np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+            'genre': np.fromiter((row[1] for row in rows), dtype=np.int16, count=len(rows)),
+            'release_year': np.fromiter((row[2] for row in rows), dtype=np.int16, count=len(rows)),
+            'ratings_avg': np.fromiter((row[3] for row in rows), dtype=np.float64, count=len(rows)),
+            'ratings_count': np.fromiter((row[4] for row in rows), dtype=np.int32, count=len(rows)),
+            'created_at': np.fromiter((row[5] for row in rows), dtype=np.int64, count=len(rows)),
+        }
+
+    def _build(self):
+        """A fresh snapshot of every visible movie, built without holding the lock"""
+        from .models import Movie
+
+        started, high_water = time.monotonic(), timezone.now()
+        rows = list(self._rows(Movie.objects.visible().order_by('id')))
+        return Snapshot(self._arrays(rows)), high_water, started
+
+    def _install(self, generation, snapshot, high_water, started, refreshed_at=None):
+        # Call with the lock held. A build begun before invalidate() may predate the change that caused it
+        if generation != self._generation:
+            return
+        self._snapshot = snapshot
+        self._high_water = high_water
+        self._rebuilt_at = started
+        self._refreshed_at = started if refreshed_at is None else refreshed_at
+
+    def _load_changes(self):
+        # Call with the lock held
+        self._snapshot, self._high_water, self._refreshed_at = self._catch_up(self._snapshot, self._high_water)
+
+    def _catch_up(self, snapshot, since):
+        """``snapshot`` with the movies changed since ``since`` applied, plus the new high water and start time"""
+        from .models import Movie
+
+        started, high_water = time.monotonic(), timezone.now()
+        changed = Movie.objects.order_by('id').filter(
+            updated_at__gte=since - timedelta(seconds=self.options['OVERLAP'])
+        )
+        hidden = np.fromiter(changed.filter(pending_deletion=True).values_list('id', flat=True), dtype=np.int64)
+        rows = list(self._rows(changed.filter(pending_deletion=False)))
+
+        columns = dict(snapshot.columns)
+        hidden = hidden[self._positions(columns['id'], hidden) >= 0]
+        updates = self._arrays(rows) if rows else None
+        if updates is not None:
+            positions = self._positions(columns['id'], updates['id'])
+            if (positions >= 0).all() and all(
+                np.array_equal(columns[name][positions], updates[name]) for name in COLUMNS
+            ):
+                updates = None  # only rows re-read inside the overlap window
+        if updates is None and not len(hidden):
+            return snapshot, high_water, started  # nothing changed: keep the snapshot and its cached sort orders
+
+        if len(hidden):
+            keep = ~np.isin(columns['id'], hidden)
+            columns = {name: array[keep] for name, array in columns.items()}
+        if updates is not None:
+            positions = self._positions(columns['id'], updates['id'])
+            exists = positions >= 0
+            for name in COLUMNS:
+                columns[name] = columns[name].copy()
+                columns[name][positions[exists]] = updates[name][exists]
+            if not exists.all():
+                new = ~exists
+                at = np.searchsorted(columns['id'], updates['id'][new])
+                columns = {name: np.insert(columns[name], at, updates[name][new]) for name in COLUMNS}
+        return Snapshot(columns), high_water, started
+
+    @staticmethod
+    def _positions(ids, wanted):
+        """Index of each of the ``wanted`` ids in the sorted ``ids``, -1 where missing"""
+        if not len(ids):
+            return np.full(len(wanted), -1)
+        # A position past the end clamps to the last id, which is smaller, so it reads as missing
+        positions = np.minimum(np.searchsorted(ids, wanted), len(ids) - 1)
+        return np.where(ids[positions] == wanted, positions, -1)
+
+
+movie_catalog = MovieCatalog()
@@ -0,0 +1,75 @@
+"""
+Sharded rating counters for hot movies.
+
+With ``RATING_COUNTER_SHARDS = N`` (N > 0) a rating write no longer touches the
+movie row. It adds its per-star delta to one of N ``MovieRatingShard`` rows
+picked at random, so concurrent raters of the same movie contend on N row
+locks instead of one. ``fold()`` moves the accumulated deltas into the Movie
+counters; the outbox worker calls it on every tick.
+"""
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+
+DELTA_FIELDS = {star: f'rating_{star}_delta' for star in range(1, 6)}
+
+
+def shard_count():
+    return getattr(settings, 'RATING_COUNTER_SHARDS', 0)
+
+
+def is_enabled():
+    return shard_count() > 0
+
+
+def add(movie_id, star_deltas):
+    """Add ``star_deltas`` (star -> change) to a random shard of the movie"""
+    from .models import MovieRatingShard
+
+    if not star_deltas:
+        return
+    shard = random.randrange(shard_count())
+    updates = {DELTA_FIELDS[star]: F(DELTA_FIELDS[star]) + n for star, n in star_deltas.items()}
+    if MovieRatingShard.objects.filter(movie_id=movie_id, shard=shard).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            MovieRatingShard.objects.create(
+                movie_id=movie_id,
+                shard=shard,
+                **{DELTA_FIELDS[star]: n for star, n in star_deltas.items()},
+            )
+    except IntegrityError:
+        # Another writer created the shard row first
+        MovieRatingShard.objects.filter(movie_id=movie_id, shard=shard).update(**updates)
+
+
+def fold(movie_ids=None):
+    """
+    Apply pending shard deltas to the Movie counters and delete the folded shards.
+
+    Folds every movie with pending shards, or only ``movie_ids`` when given.
+    Returns the number of movies updated.
+    """
+    from .cache import movie_cache
+    from .models import Movie, MovieRatingShard
+
+    shards = MovieRatingShard.objects.all()
+    if movie_ids is not None:
+        shards = shards.filter(movie_id__in=movie_ids)
+    pending = list(shards.values_list('movie_id', flat=True).distinct())
+
+    for movie_id in pending:
+        with transaction.atomic():
+            rows = list(MovieRatingShard.objects.select_for_update().filter(movie_id=movie_id))
+            totals = {
+                star: sum(getattr(row, field) for row in rows)
+                for star, field in DELTA_FIELDS.items()
+            }
+            Movie.objects.filter(id=movie_id).apply_rating_delta(totals)
+            MovieRatingShard.objects.filter(id__in=[row.id for row in rows]).delete()
+            movie_cache.invalidate_on_commit(movie_id)
+    return len(pending)
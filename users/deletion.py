@@ -0,0 +1,188 @@
+"""
+Chunked deletion of movies and users with large rating sets.
+
+``request_movie_deletion()`` hides the movie at once (``pending_deletion``) and
+records a ``MovieDeletion``. ``run_deletion()`` then removes the ratings in
+chunks of RATING_DELETE_CHUNK_SIZE, one short transaction per chunk, without
+loading them into memory, and finally deletes the movie row itself.
+
+In ``deferred`` outbox mode ``manage.py run_outbox_worker`` picks up pending
+deletions. In ``sync`` mode a background thread starts on the request's commit,
+so the response still reports the job as pending. A deletion cut short by a
+restart stays ``running`` until a ``run_outbox_worker`` re-claims it.
+
+``delete_user_ratings()`` runs before a user is deleted. Each chunk of their
+ratings is turned into per-movie star deltas by one grouped query, the deltas
+go to the movies in bulk UPDATEs, and the chunk is deleted, all in one
+transaction, so the movie aggregates are exact after every chunk.
+"""
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import outbox
+from .cache import movie_cache
+
+
+# Movies per bulk stats UPDATE; each movie adds a CASE branch per changed star
+MOVIES_PER_UPDATE = 200
+
+# A running deletion whose progress has not moved for this long is assumed abandoned
+STALE_AFTER = timedelta(minutes=5)
+
+
+def chunk_size():
+    return getattr(settings, 'RATING_DELETE_CHUNK_SIZE', 1000)
+
+
+def request_movie_deletion(movie, user):
+    """Hide ``movie`` and queue its deletion; returns the MovieDeletion"""
+    from .models import Movie, MovieDeletion
+
+    with transaction.atomic():
+        # updated_at moves too, so incremental readers (users/catalog.py) see the movie go
+        Movie.objects.filter(id=movie.id).update(pending_deletion=True, updated_at=timezone.now())
+        movie_cache.invalidate_on_commit(movie.id)
+        job = MovieDeletion.objects.create(
+            movie_id=movie.id,
+            movie_title=movie.title,
+            requested_by=user,
+            ratings_total=movie.ratings_count,
+        )
+        if not outbox.is_deferred():
+            transaction.on_commit(lambda: start_in_background(job.id), robust=True)
+    return job
+
+
+def start_in_background(job_id):
+    """Run the deletion on a daemon thread with its own database connection"""
+    thread = threading.Thread(
+        target=_run_in_thread, args=(job_id,), name=f'movie-deletion-{job_id}', daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _run_in_thread(job_id):
+    try:
+        run_claimed(job_id)
+    finally:
+        connection.close()
+
+
+def run_claimed(job_id):
+    """Run the deletion unless another runner already claimed it; returns whether it ran"""
+    from .models import MovieDeletion
+
+    claimed = MovieDeletion.objects.filter(id=job_id, status=MovieDeletion.STATUS_PENDING).update(
+        status=MovieDeletion.STATUS_RUNNING, updated_at=timezone.now(),
+    )
+    if claimed:
+        run_deletion(job_id)
+    return bool(claimed)
+
+
+def claim_next():
+    """Mark the oldest pending (or abandoned) deletion as running and return it"""
+    from .models import MovieDeletion
+
+    stale = timezone.now() - STALE_AFTER
+    with transaction.atomic():
+        job = (
+            MovieDeletion.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=MovieDeletion.STATUS_PENDING)
+                | Q(status=MovieDeletion.STATUS_RUNNING, updated_at__lt=stale)
+            )
+            .order_by('id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = MovieDeletion.STATUS_RUNNING
+        job.save(update_fields=['status', 'updated_at'])
+    return job
+
+
+def run_deletion(job_id):
+    """Delete the ratings of the job's movie chunk by chunk, then the movie"""
+    from .models import Movie, MovieDeletion, Rating
+
+    jobs = MovieDeletion.objects.filter(id=job_id)
+    jobs.update(status=MovieDeletion.STATUS_RUNNING, updated_at=timezone.now())
+    job = jobs.get()
+    try:
+        while True:
+            ids = list(
+                Rating.objects.filter(movie_id=job.movie_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size()]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                # Nothing references a rating and no delete signals are connected, so this is a
+                # single DELETE with no per-row stats upkeep: the movie goes away with its ratings
+                deleted, _ = Rating.objects.filter(id__in=ids).delete()
+                jobs.update(ratings_deleted=F('ratings_deleted') + deleted, updated_at=timezone.now())
+
+        with transaction.atomic():
+            # Only a handful of rows (counter shards, late ratings) are left to cascade
+            Movie.objects.filter(id=job.movie_id).delete()
+            movie_cache.invalidate_on_commit(job.movie_id)
+            jobs.update(status=MovieDeletion.STATUS_COMPLETED, completed_at=timezone.now(), updated_at=timezone.now())
+    except Exception as exc:
+        jobs.update(status=MovieDeletion.STATUS_FAILED, error=str(exc), updated_at=timezone.now())
+        raise
+    return jobs.get()
+
+
+def process_pending():
+    """Run every queued deletion; returns how many were run"""
+    count = 0
+    while (job := claim_next()) is not None:
+        run_deletion(job.id)
+        count += 1
+    return count
+
+
+def delete_user_ratings(user_ids):
+    """
+    Delete the ratings of ``user_ids`` and subtract them from the movie stats.
+
+    Returns the number of ratings deleted.
+    """
+    from .models import Movie, Rating
+
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Rating.objects.select_for_update()
+                .filter(user_id__in=user_ids)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size()]
+            )
+            if not ids:
+                return total
+            deltas = {}
+            rows = (
+                Rating.objects.filter(id__in=ids)
+                .values_list('movie_id', 'rating')
+                .annotate(n=Count('id'))
+                .order_by()
+            )
+            for movie_id, star, n in rows:
+                deltas.setdefault(movie_id, {})[star] = -n
+            movie_ids = sorted(deltas)
+            for start in range(0, len(movie_ids), MOVIES_PER_UPDATE):
+                batch = movie_ids[start:start + MOVIES_PER_UPDATE]
+                Movie.objects.apply_rating_deltas({movie_id: deltas[movie_id] for movie_id in batch})
+            # A single fast DELETE, like the chunks in run_deletion()
+            deleted, _ = Rating.objects.filter(id__in=ids).delete()
+            total += deleted
+            movie_cache.invalidate_on_commit(*movie_ids)
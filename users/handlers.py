@@ -0,0 +1,18 @@
+"""Outbox handlers; imported from UsersConfig.ready() so they are registered at startup"""
+from . import outbox, trending
+from .models import Movie
+
+
+@outbox.register('rating.changed')
+def refresh_movie_stats(events_by_key):
+    # However many ratings changed, each movie is recomputed once per batch
+    for movie in Movie.objects.filter(id__in=list(events_by_key)):
+        movie.update_ratings_stats()
+
+
+@outbox.register('rating.created')
+def update_trending_scores(events_by_key):
+    trending.record({
+        int(movie_id): [payload['at'] for payload in payloads]
+        for movie_id, payloads in events_by_key.items()
+    })
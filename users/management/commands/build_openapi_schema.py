@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from users import schema
+
+
+class Command(BaseCommand):
+    help = "Generate the OpenAPI schema for the current code version into OPENAPI_SCHEMA_DIR"
+
+    def handle(self, *args, **options):
+        version = schema.code_version()
+        generated = schema.generate_schema()
+        bodies = {}
+        for fmt in schema.RENDERERS:
+            path = schema.schema_path(fmt, version)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            bodies[fmt] = schema.render_schema(generated, fmt)
+            path.write_bytes(bodies[fmt])
+            self.stdout.write(f"Wrote {path}")
+        schema.write_manifest(version, bodies)
+        self.stdout.write(f"Wrote {schema.manifest_path()} for version {version}")
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from users import partitioning
+from users.models import Rating
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ratings table with RATING_PARTITIONS hash partitions (PostgreSQL; blocks rating writes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, help='Partition count, 0 for a single table (default: setting)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning needs PostgreSQL")
+        partitions = options['partitions']
+        if partitions is None:
+            partitions = getattr(settings, 'RATING_PARTITIONS', 0)
+        if partitions < 0:
+            raise CommandError("--partitions must be 0 or more")
+
+        table = Rating._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            changed = partitioning.repartition(cursor, table, partitions)
+        layout = f"{partitions} hash partition(s)" if partitions else "a single table"
+        self.stdout.write(f"{table} {'rebuilt as' if changed else 'already is'} {layout}")
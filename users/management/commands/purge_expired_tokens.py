@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = "Delete expired outstanding/blacklisted JWT rows in small chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to sleep between chunks')
+        parser.add_argument('--every', type=float, default=0, help='Repeat the purge every N seconds (0 runs once)')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = self.purge(options['chunk_size'], options['pause'])
+            self.stdout.write(f"Purged {deleted} expired token(s)")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
+
+    def purge(self, chunk_size, pause):
+        deleted = 0
+        now = timezone.now()
+        while True:
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=now)
+                .order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return deleted
+            with transaction.atomic():
+                # Children first (a fast DELETE, nothing references them); the collector then
+                # loads only the ids of the parents and finds no blacklist rows left to cascade
+                BlacklistedToken.objects.filter(token_id__in=ids).delete()
+                OutstandingToken.objects.filter(id__in=ids).only('id').delete()
+            deleted += len(ids)
+            time.sleep(pause)
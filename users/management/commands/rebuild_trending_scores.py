@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users import trending
+
+
+class Command(BaseCommand):
+    help = "Recompute trending scores from rating timestamps (after deploying, or changing the half-life)"
+
+    def handle(self, *args, **options):
+        scored = trending.rebuild()
+        self.stdout.write(f"Scored {scored} movie(s)")
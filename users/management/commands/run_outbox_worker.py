@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users import counters, deletion, outbox
+
+
+class Command(BaseCommand):
+    help = "Apply pending outbox events, fold sharded rating counters and run queued movie deletions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Events claimed per transaction')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write(f"Outbox worker started (batch size {batch_size})")
+        while True:
+            handled = outbox.process_batch(batch_size)
+            if handled:
+                self.stdout.write(f"Applied {handled} event(s)")
+            if counters.is_enabled():
+                folded = counters.fold()
+                if folded:
+                    self.stdout.write(f"Folded rating shards for {folded} movie(s)")
+            deleted = deletion.process_pending()
+            if deleted:
+                self.stdout.write(f"Deleted {deleted} movie(s)")
+            if handled:
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+
+
+DEFAULT_TABLES = ['users_movie', 'users_rating']
+
+
+class Command(BaseCommand):
+    help = "Report on-disk table and index sizes (PostgreSQL, or SQLite with the dbstat table)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*', default=DEFAULT_TABLES, help='Tables to report')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'postgresql':
+            sizes = self.postgresql_sizes(options['tables'])
+        elif connection.vendor == 'sqlite':
+            sizes = self.sqlite_sizes(options['tables'])
+        else:
+            raise CommandError(f"Unsupported database: {connection.vendor}")
+
+        for table in options['tables']:
+            rows, heap, indexes = sizes[table]
+            self.stdout.write(
+                f"{table}: {rows} rows, table {self.format_bytes(heap)}, "
+                f"indexes {self.format_bytes(sum(size for _, size in indexes))}"
+            )
+            for name, size in indexes:
+                self.stdout.write(f"  {name}: {self.format_bytes(size)}")
+
+    def postgresql_sizes(self, tables):
+        # Partitioned tables and indexes are summed over their partitions; row counts are estimates
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT c.relname, SUM(GREATEST(p.reltuples, 0))::bigint, SUM(pg_table_size(p.oid))
+                FROM pg_class c
+                LEFT JOIN LATERAL pg_partition_tree(c.oid) t ON t.isleaf
+                JOIN pg_class p ON p.oid = COALESCE(t.relid, c.oid)
+                WHERE c.relkind IN ('r', 'p') AND c.relname = ANY(%s)
+                GROUP BY c.relname
+                """,
+                [tables],
+            )
+            sizes = {table: (rows, heap, []) for table, rows, heap in cursor.fetchall()}
+            cursor.execute(
+                """
+                SELECT t.relname, i.relname, COALESCE(
+                    (SELECT SUM(pg_relation_size(relid)) FROM pg_partition_tree(i.oid)), pg_relation_size(i.oid)
+                )
+                FROM pg_index x JOIN pg_class t ON t.oid = x.indrelid JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE t.relname = ANY(%s) ORDER BY 3 DESC
+                """,
+                [tables],
+            )
+            for table, index, size in cursor.fetchall():
+                sizes[table][2].append((index, size))
+        self.check_found(tables, sizes)
+        return sizes
+
+    def sqlite_sizes(self, tables):
+        sizes = {}
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")
+            except OperationalError:
+                raise CommandError("This SQLite build has no dbstat virtual table")
+            pages = dict(cursor.fetchall())
+            for table in tables:
+                if table not in pages:
+                    continue
+                cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(table)}")
+                rows = cursor.fetchone()[0]
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s", [table])
+                indexes = sorted(((name, pages.get(name, 0)) for name, in cursor.fetchall()), key=lambda item: -item[1])
+                sizes[table] = (rows, pages[table], indexes)
+        self.check_found(tables, sizes)
+        return sizes
+
+    def check_found(self, tables, sizes):
+        missing = [table for table in tables if table not in sizes]
+        if missing:
+            raise CommandError(f"Unknown table(s): {', '.join(missing)}")
+
+    @staticmethod
+    def format_bytes(size):
+        for unit in ('B', 'KiB', 'MiB', 'GiB'):
+            if size < 1024 or unit == 'GiB':
+                return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+            size /= 1024
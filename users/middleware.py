@@ -0,0 +1,211 @@
+import cProfile
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import profiling
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+
+COMPRESSION_DEFAULTS = {
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 1,
+    'BROTLI_QUALITY': 4,
+    'CACHE_ENTRIES': 256,
+    'CACHE_MAX_BODY': 1024 * 1024,
+    'EXCLUDE_PATHS': [],
+}
+
+
+def parse_accept_encoding(header):
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            codings[coding.strip().lower()] = q
+    return codings
+
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip compression for API response bodies above a size threshold.
+
+    Only paths under API_PATH_PREFIX are compressed. Admin and other HTML pages
+    put the CSRF token next to reflected input such as the changelist ``?q=``,
+    which is what BREACH needs, and their transfer size does not matter here.
+
+    Levels favour latency over ratio. Compressed bodies are kept in a small LRU
+    keyed by encoding plus the ETag (or a digest of the body), so an identical
+    hot response, e.g. one served from a cache, is compressed only once.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = {**COMPRESSION_DEFAULTS, **getattr(settings, 'COMPRESSION', {})}
+        self._compressed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or not is_api_request(request)
+            or len(response.content) < self.options['MIN_SIZE']
+            or request.path.startswith(tuple(self.options['EXCLUDE_PATHS']))
+        ):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        body = self.compressed_body(response, encoding)
+        if len(body) >= len(response.content):
+            return response
+        response.content = body
+        response.headers['Content-Length'] = str(len(body))
+        response.headers['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
+
+    def choose_encoding(self, header):
+        codings = parse_accept_encoding(header)
+        wildcard = codings.get('*', 0.0)
+        candidates = (['br'] if brotli is not None else []) + ['gzip']
+        # On equal q-values brotli wins, it compresses JSON better at the same speed
+        best = max(candidates, key=lambda coding: codings.get(coding, wildcard))
+        return best if codings.get(best, wildcard) > 0 else None
+
+    def compressed_body(self, response, encoding):
+        content = response.content
+        if len(content) > self.options['CACHE_MAX_BODY']:
+            return self.compress(content, encoding)
+
+        etag = response.get('ETag', '')
+        if etag.startswith('"'):
+            key = (encoding, etag)
+        else:
+            key = (encoding, hashlib.blake2b(content, digest_size=16).digest())
+        with self._lock:
+            body = self._compressed.get(key)
+            if body is not None:
+                self._compressed.move_to_end(key)
+                return body
+        body = self.compress(content, encoding)
+        with self._lock:
+            self._compressed[key] = body
+            while len(self._compressed) > self.options['CACHE_ENTRIES']:
+                self._compressed.popitem(last=False)
+        return body
+
+    def compress(self, content, encoding):
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.options['BROTLI_QUALITY'])
+        return gzip.compress(content, compresslevel=self.options['GZIP_LEVEL'], mtime=0)
+
+
+def is_api_request(request):
+    return request.path_info.startswith(getattr(settings, 'API_PATH_PREFIX', '/api/'))
+
+
+class SkipForApiMixin:
+    """
+    Runs the wrapped browser-oriented middleware only outside the API prefix.
+
+    API views authenticate with JWT and never touch sessions, messages or CSRF
+    cookies, so for /api/ requests the middleware hands straight to the next layer.
+    Subclassing keeps Django's admin system checks satisfied.
+    """
+
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class ScopedSessionMiddleware(SkipForApiMixin, SessionMiddleware):
+    pass
+
+
+class ScopedCsrfViewMiddleware(SkipForApiMixin, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if is_api_request(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class ScopedAuthenticationMiddleware(SkipForApiMixin, AuthenticationMiddleware):
+    pass
+
+
+class ScopedMessageMiddleware(SkipForApiMixin, MessageMiddleware):
+    pass
+
+
+class ScopedXFrameOptionsMiddleware(SkipForApiMixin, XFrameOptionsMiddleware):
+    pass
+
+
+class ProfilingMiddleware:
+    """
+    Runs a request under cProfile when a staff user asks for it with an
+    ``X-Profile: 1`` header or a ``_profile=1`` query parameter.
+
+    The response gets ``X-Profile-Id`` and ``X-Profile-Summary`` headers; the
+    stored pstats file is served by the admin-only /api/system/profiles/ views.
+    Requests without the flag pass straight through after a string lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.META.get('HTTP_X_PROFILE') != '1' and '_profile=1' not in request.META.get('QUERY_STRING', ''):
+            return self.get_response(request)
+        user = self.staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        response = profiler.runcall(self.get_response, request)
+        profile_id, summary = profiling.save(profiler, request, response, user)
+        response.headers['X-Profile-Id'] = profile_id
+        response.headers['X-Profile-Summary'] = summary
+        return response
+
+    def staff_user(self, request):
+        # Authentication normally happens inside the view; it is done here only for flagged requests
+        try:
+            result = JWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if result is None or not result[0].is_staff:
+            return None
+        return result[0]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_rating_histogram(apps, schema_editor):
+    """
+    Fill the per-star counters one batch of movies at a time.
+
+    Each batch is a plain SELECT over the ratings index plus an UPDATE of the
+    batch's movie rows, committed on its own so no long lock is held on either table.
+    """
+    Movie = apps.get_model('users', 'Movie')
+    Rating = apps.get_model('users', 'Rating')
+    fields = ['rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count']
+
+    last_id = 0
+    while True:
+        movie_ids = list(
+            Movie.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not movie_ids:
+            break
+        last_id = movie_ids[-1]
+
+        counts = {}
+        rows = (
+            Rating.objects.filter(movie_id__in=movie_ids)
+            .order_by()
+            .values('movie_id', 'rating')
+            .annotate(n=Count('id'))
+        )
+        for row in rows:
+            if 1 <= row['rating'] <= 5:
+                counts.setdefault(row['movie_id'], {})[row['rating']] = row['n']
+
+        movies = []
+        for movie_id in movie_ids:
+            movie = Movie(id=movie_id)
+            for star, field in enumerate(fields, start=1):
+                setattr(movie, field, counts.get(movie_id, {}).get(star, 0))
+            movies.append(movie)
+        Movie.objects.bulk_update(movies, fields)
+
+
+class Migration(migrations.Migration):
+
+    # Batches commit individually instead of inside one migration-wide transaction
+    atomic = False
+
+    dependencies = [
+        ('users', '0002_movie_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_histogram, migrations.RunPython.noop),
+    ]
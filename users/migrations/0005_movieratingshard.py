@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_outboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieRatingShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('rating_1_delta', models.IntegerField(default=0)),
+                ('rating_2_delta', models.IntegerField(default=0)),
+                ('rating_3_delta', models.IntegerField(default=0)),
+                ('rating_4_delta', models.IntegerField(default=0)),
+                ('rating_5_delta', models.IntegerField(default=0)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_shards', to='users.movie')),
+            ],
+            options={
+                'unique_together': {('movie', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:33
+
+from django.db import migrations, models
+
+
+# Case-insensitive prefix search (istartswith) compiles to UPPER(col::text) LIKE UPPER('x%'),
+# which PostgreSQL can only serve from a text_pattern_ops index on the same expression
+PATTERN_INDEXES = [
+    ('users_customuser_email_upper_idx', 'users_customuser', 'email'),
+    ('users_movie_title_upper_idx', 'users_movie', 'title'),
+]
+
+
+def create_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in PATTERN_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} (UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in PATTERN_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0006_movie_pending_deletion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['created_at', 'id'], name='movie_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['created_at', 'id'], name='rating_created_idx'),
+        ),
+        migrations.RunPython(create_pattern_indexes, drop_pattern_indexes),
+    ]
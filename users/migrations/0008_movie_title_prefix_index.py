@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+# Must match MovieQuerySet.title_prefix(): UPPER(title) in byte order, so
+# "key >= 'ABC' AND key < 'ABC\U0010ffff' ORDER BY key" is a bounded index range scan
+INDEX_SQL = {
+    'postgresql': 'CREATE INDEX CONCURRENTLY IF NOT EXISTS users_movie_title_prefix_idx ON users_movie ((UPPER(title) COLLATE "C"), id)',
+    'sqlite': 'CREATE INDEX IF NOT EXISTS users_movie_title_prefix_idx ON users_movie (UPPER(title) COLLATE BINARY, id)',
+}
+
+DROP_SQL = {
+    'postgresql': 'DROP INDEX CONCURRENTLY IF EXISTS users_movie_title_prefix_idx',
+    'sqlite': 'DROP INDEX IF EXISTS users_movie_title_prefix_idx',
+}
+
+
+def create_title_prefix_index(apps, schema_editor):
+    sql = INDEX_SQL.get(schema_editor.connection.vendor)
+    if sql:
+        schema_editor.execute(sql)
+
+
+def drop_title_prefix_index(apps, schema_editor):
+    sql = DROP_SQL.get(schema_editor.connection.vendor)
+    if sql:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0007_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_title_prefix_index, drop_title_prefix_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_movie_title_prefix_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['ratings_avg', 'created_at', 'id'], name='movie_rating_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['ratings_count', 'id'], name='movie_count_sort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['release_year', 'id'], name='movie_year_sort_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_movie_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieTrendingScore',
+            fields=[
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='users.movie')),
+                ('log_score', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['log_score', 'movie'], name='trending_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,131 @@
+"""
+Compact storage, step 1 of 2: shadow columns and an online backfill.
+
+Movie.genre moves from varchar to a small-int code and Rating.rating from
+integer to smallint. Each new value goes into a nullable shadow column
+(genre_code, rating_small). On PostgreSQL, a trigger keeps the shadow column
+in step with writes from the code still running. The backfill runs in short
+id-range transactions. Finally, a NOT VALID check constraint is validated
+without blocking writes, which lets 0013 swap the columns and SET NOT NULL
+without a table scan under an exclusive lock.
+
+release_year is changed in place. Rewriting users_movie is short next to
+users_rating, and the column sits in the unique and sort indexes.
+"""
+import django.core.validators
+from django.db import migrations, models, transaction
+from django.db.models import Case, F, Max, Min, When
+
+
+BATCH_SIZE = 5000
+
+# Movie.Genre as of this migration: label -> code; unknown labels become Other
+GENRE_CODES = {
+    'Action': 1, 'Comedy': 2, 'Drama': 3, 'Horror': 4, 'Sci-Fi': 5,
+    'Romance': 6, 'Thriller': 7, 'Fantasy': 8, 'Documentary': 9, 'Other': 10,
+}
+OTHER = 10
+
+# (table, source column, shadow column, plpgsql expression for the shadow value)
+SHADOW_COLUMNS = [
+    ('users_movie', 'genre', 'genre_code',
+     'CASE UPPER(NEW.genre) ' + ' '.join(
+         f"WHEN '{label.upper()}' THEN {code}" for label, code in GENRE_CODES.items()
+     ) + f' ELSE {OTHER} END'),
+    ('users_rating', 'rating', 'rating_small', 'NEW.rating'),
+]
+
+
+def install_sync_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, source, shadow, expression in SHADOW_COLUMNS:
+        schema_editor.execute(f"""
+            CREATE OR REPLACE FUNCTION {table}_{shadow}_sync() RETURNS trigger AS $$
+            BEGIN
+                NEW.{shadow} := {expression};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        schema_editor.execute(f"""
+            CREATE TRIGGER {table}_{shadow}_sync BEFORE INSERT OR UPDATE OF {source} ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {table}_{shadow}_sync()
+        """)
+
+
+def drop_sync_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, _, shadow, _ in SHADOW_COLUMNS:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_{shadow}_sync ON {table}')
+        schema_editor.execute(f'DROP FUNCTION IF EXISTS {table}_{shadow}_sync()')
+
+
+def backfill_batches(model, field, value, using):
+    bounds = model.objects.using(using).aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, BATCH_SIZE):
+        # One short transaction per id range, so row locks are held briefly
+        with transaction.atomic(using=using):
+            model.objects.using(using).filter(
+                id__gte=start, id__lt=start + BATCH_SIZE, **{f'{field}__isnull': True}
+            ).update(**{field: value})
+
+
+def backfill(apps, schema_editor):
+    using = schema_editor.connection.alias
+    genre_code = Case(*[When(genre__iexact=label, then=code) for label, code in GENRE_CODES.items()], default=OTHER)
+    backfill_batches(apps.get_model('users', 'Movie'), 'genre_code', genre_code, using)
+    backfill_batches(apps.get_model('users', 'Rating'), 'rating_small', F('rating'), using)
+
+
+def add_not_null_checks(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, _, shadow, _ in SHADOW_COLUMNS:
+        # NOT VALID takes the lock only briefly; VALIDATE scans without blocking writes
+        schema_editor.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_{shadow}_not_null CHECK ({shadow} IS NOT NULL) NOT VALID'
+        )
+        schema_editor.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {table}_{shadow}_not_null')
+
+
+def drop_not_null_checks(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, _, shadow, _ in SHADOW_COLUMNS:
+        schema_editor.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{shadow}_not_null')
+
+
+class Migration(migrations.Migration):
+    # Every step commits on its own so the backfill never holds one long transaction
+    atomic = False
+
+    dependencies = [
+        ('users', '0011_movie_updated_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='release_year',
+            field=models.SmallIntegerField(validators=[
+                django.core.validators.MinValueValidator(1900), django.core.validators.MaxValueValidator(2100),
+            ]),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='genre_code',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='rating',
+            name='rating_small',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.RunPython(install_sync_triggers, drop_sync_triggers),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.RunPython(add_not_null_checks, drop_not_null_checks),
+    ]
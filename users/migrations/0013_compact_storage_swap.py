@@ -0,0 +1,88 @@
+"""
+Compact storage, step 2 of 2: swap the backfilled shadow columns in.
+
+On PostgreSQL, every statement here only changes the catalog. DROP COLUMN
+and RENAME COLUMN don't touch the rows. SET NOT NULL relies on the check
+constraint that 0012 validated. So the exclusive locks last milliseconds.
+The dropped columns' space is reused as rows are updated; to reclaim it at
+once, run pg_repack (or VACUUM FULL during a maintenance window).
+
+Not reversible: the varchar genre and integer rating columns are gone.
+"""
+import django.core.validators
+from django.db import migrations, models
+
+
+# (table, shadow column) pairs from 0012
+SHADOW_COLUMNS = [('users_movie', 'genre_code'), ('users_rating', 'rating_small')]
+
+
+def drop_sync_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, shadow in SHADOW_COLUMNS:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_{shadow}_sync ON {table}')
+        schema_editor.execute(f'DROP FUNCTION IF EXISTS {table}_{shadow}_sync()')
+
+
+def drop_not_null_checks(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, shadow in SHADOW_COLUMNS:
+        # The constraint follows the renamed column; SET NOT NULL has made it redundant
+        schema_editor.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{shadow}_not_null')
+
+
+def restore_sqlite_title_prefix_index(apps, schema_editor):
+    # SQLite alters columns by rebuilding the table, which loses the raw-SQL index from 0008
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS users_movie_title_prefix_idx ON users_movie (UPPER(title) COLLATE BINARY, id)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_compact_storage_backfill'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_sync_triggers),
+        migrations.RemoveField(
+            model_name='movie',
+            name='genre',
+        ),
+        migrations.RemoveField(
+            model_name='rating',
+            name='rating',
+        ),
+        migrations.RenameField(
+            model_name='movie',
+            old_name='genre_code',
+            new_name='genre',
+        ),
+        migrations.RenameField(
+            model_name='rating',
+            old_name='rating_small',
+            new_name='rating',
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='genre',
+            field=models.SmallIntegerField(choices=[
+                (1, 'Action'), (2, 'Comedy'), (3, 'Drama'), (4, 'Horror'), (5, 'Sci-Fi'),
+                (6, 'Romance'), (7, 'Thriller'), (8, 'Fantasy'), (9, 'Documentary'), (10, 'Other'),
+            ]),
+        ),
+        migrations.AlterField(
+            model_name='rating',
+            name='rating',
+            field=models.SmallIntegerField(validators=[
+                django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5),
+            ]),
+        ),
+        migrations.RunPython(drop_not_null_checks),
+        migrations.RunPython(restore_sqlite_title_prefix_index),
+    ]
@@ -1,11 +1,46 @@
-from django.db import models
+from django.db import IntegrityError, connection, connections, models, transaction
+from django.db.models import Case, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Coalesce, Collate, NullIf, Upper
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 
+from . import counters, deletion, outbox
+from .cache import movie_cache
+
+
+# Per-star counter columns on Movie, keyed by star value
+RATING_HISTOGRAM_FIELDS = {
+    1: 'rating_1_count',
+    2: 'rating_2_count',
+    3: 'rating_3_count',
+    4: 'rating_4_count',
+    5: 'rating_5_count',
+}
+
+
+def rating_histogram_delta(old, new):
+    """Star -> counter change for a rating going from ``old`` to ``new`` (either may be None)"""
+    delta = {}
+    if old is not None:
+        delta[old] = delta.get(old, 0) - 1
+    if new is not None:
+        delta[new] = delta.get(new, 0) + 1
+    return {star: n for star, n in delta.items() if n and star in RATING_HISTOGRAM_FIELDS}
 
 
 # Create your models here.
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    def delete(self):
+        # Cascading would drop the ratings without touching the movie aggregates
+        deletion.delete_user_ratings(list(self.values_list('pk', flat=True)))
+        return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     def create_user(self, email, username, password=None, **extra_fields):
         if not email:
             raise ValueError("Email Field must be set")
@@ -37,24 +72,123 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    def delete(self, *args, **kwargs):
+        # Remove ratings through the stats-preserving path before the cascade runs
+        deletion.delete_user_ratings([self.pk])
+        return super().delete(*args, **kwargs)
+
+
+# Byte-order collation per backend, so one btree index on UPPER(title) serves both
+# the prefix range and the ORDER BY of title_prefix() (see migration 0008)
+TITLE_KEY_COLLATIONS = {
+    'postgresql': 'C',
+    'sqlite': 'BINARY',
+}
+
+
+class MovieQuerySet(models.QuerySet):
+    def visible(self):
+        """Movies not waiting for a background deletion"""
+        return self.filter(pending_deletion=False)
+
+    def title_prefix(self, prefix):
+        """Movies whose title starts with ``prefix`` (case-insensitive), in title order"""
+        key = Upper('title')
+        collation = TITLE_KEY_COLLATIONS.get(connections[self.db].vendor)
+        if collation:
+            key = Collate(key, collation)
+        prefix = prefix.upper()
+        # A range rather than LIKE: every backend turns it into a bounded index scan
+        return (
+            self.alias(title_key=key)
+            .filter(title_key__gte=prefix, title_key__lt=prefix + '\U0010ffff')
+            .order_by('title_key', 'id')
+        )
+
+    def apply_rating_delta(self, star_deltas):
+        """
+        Shift the per-star counters by ``star_deltas`` in a single UPDATE and
+        rederive ratings_count/ratings_avg from them in the same statement.
+        """
+        counts = {
+            star: F(field) + star_deltas.get(star, 0)
+            for star, field in RATING_HISTOGRAM_FIELDS.items()
+        }
+        count = sum(counts.values(), Value(0))
+        total = sum((star * expr for star, expr in counts.items()), Value(0))
+        return self.update(
+            **{field: counts[star] for star, field in RATING_HISTOGRAM_FIELDS.items()},
+            ratings_count=count,
+            ratings_avg=Coalesce(Cast(total, FloatField()) / NullIf(count, 0), Value(0.0)),
+            updated_at=timezone.now(),
+        )
+
+    def apply_rating_deltas(self, deltas_by_movie):
+        """
+        Apply a different star delta to each movie in one UPDATE.
+        ``deltas_by_movie`` maps movie id -> {star: change}.
+        """
+        star_deltas = {}
+        for star in RATING_HISTOGRAM_FIELDS:
+            whens = [
+                When(id=movie_id, then=Value(deltas[star]))
+                for movie_id, deltas in deltas_by_movie.items()
+                if deltas.get(star)
+            ]
+            if whens:
+                star_deltas[star] = Case(*whens, default=Value(0))
+        return self.filter(id__in=list(deltas_by_movie)).apply_rating_delta(star_deltas)
+
+    def apply_rating_delta_returning(self, movie_id, star_deltas):
+        """
+        Same as ``apply_rating_delta`` for one movie, but returns the movie's
+        new id/title/ratings_count/ratings_avg from the UPDATE itself.
+        Returns None when the movie does not exist or is pending deletion.
+        """
+        table = self.model._meta.db_table
+        counts = [f"({field} + %s)" for field in RATING_HISTOGRAM_FIELDS.values()]
+        deltas = [star_deltas.get(star, 0) for star in RATING_HISTOGRAM_FIELDS]
+        count_sql = " + ".join(counts)
+        total_sql = " + ".join(f"{star} * {expr}" for star, expr in zip(RATING_HISTOGRAM_FIELDS, counts))
+        assignments = [f"{field} = {expr}" for field, expr in zip(RATING_HISTOGRAM_FIELDS.values(), counts)]
+        sql = f"""
+            UPDATE {table} SET
+                {", ".join(assignments)},
+                ratings_count = {count_sql},
+                ratings_avg = COALESCE(CAST({total_sql} AS DOUBLE PRECISION) / NULLIF({count_sql}, 0), 0.0),
+                updated_at = %s
+            WHERE id = %s AND pending_deletion = %s
+            RETURNING id, title, ratings_count, ratings_avg
+        """
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        params = deltas * 4 + [now, movie_id, False]
+        movie = next(iter(self.model.objects.raw(sql, params)), None)
+        movie_cache.invalidate_on_commit(movie_id)
+        return movie
+
 
 class Movie(models.Model):
-    GENRE_CHOICES = [
-        ('Action', 'Action'),
-        ('Comedy', 'Comedy'),
-        ('Drama', 'Drama'),
-        ('Horror', 'Horror'),
-        ('Sci-Fi', 'Sci-Fi'),
-        ('Romance', 'Romance'),
-        ('Thriller', 'Thriller'),
-        ('Fantasy', 'Fantasy'),
-        ('Documentary', 'Documentary'),
-        ('Other', 'Other'),
-    ]
-    
+    class Genre(models.IntegerChoices):
+        # Stored codes; the API reads and writes the labels (serializers.GenreField)
+        ACTION = 1, 'Action'
+        COMEDY = 2, 'Comedy'
+        DRAMA = 3, 'Drama'
+        HORROR = 4, 'Horror'
+        SCI_FI = 5, 'Sci-Fi'
+        ROMANCE = 6, 'Romance'
+        THRILLER = 7, 'Thriller'
+        FANTASY = 8, 'Fantasy'
+        DOCUMENTARY = 9, 'Documentary'
+        OTHER = 10, 'Other'
+
+        @classmethod
+        def from_label(cls, label):
+            """Code for a genre label, case-insensitively; None if there is no such genre"""
+            return {name.lower(): code for code, name in cls.choices}.get(label.lower())
+
     title = models.CharField(max_length=200)
-    genre = models.CharField(max_length=50, choices=GENRE_CHOICES)
-    release_year = models.IntegerField(
+    genre = models.SmallIntegerField(choices=Genre.choices)
+    release_year = models.SmallIntegerField(
         validators=[MinValueValidator(1900), MaxValueValidator(2100)]
     )
     description = models.TextField(blank=True, null=True)
@@ -65,49 +199,311 @@ class Movie(models.Model):
     # Denormalized fields for performance
     ratings_count = models.IntegerField(default=0)
     ratings_avg = models.FloatField(default=0.0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    # Hidden from reads while a MovieDeletion removes its ratings in the background
+    pending_deletion = models.BooleanField(default=False)
+
+    objects = MovieQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
         unique_together = ['title', 'release_year']  # Prevent duplicates
+        indexes = [
+            # Admin changelist order (created_at, then pk), date hierarchy and the 'newest' sort
+            models.Index(fields=['created_at', 'id'], name='movie_created_idx'),
+            # One per list_movies sort order (views.MOVIE_SORT_ORDERS); 'title' uses the unique index
+            models.Index(fields=['ratings_avg', 'created_at', 'id'], name='movie_rating_sort_idx'),
+            models.Index(fields=['ratings_count', 'id'], name='movie_count_sort_idx'),
+            models.Index(fields=['release_year', 'id'], name='movie_year_sort_idx'),
+            # High-water mark reads of the catalog snapshot (users/catalog.py)
+            models.Index(fields=['updated_at'], name='movie_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} ({self.release_year})"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        movie_cache.invalidate_on_commit(self.pk)
+
+    def delete(self, *args, **kwargs):
+        movie_id = self.pk
+        result = super().delete(*args, **kwargs)
+        movie_cache.invalidate_on_commit(movie_id)
+        return result
     
     def update_ratings_stats(self):
         """Update denormalized rating statistics"""
-        ratings = self.ratings.all()
-        self.ratings_count = ratings.count()
+        # One grouped aggregate gives the histogram; count and average derive from it
+        histogram = self.ratings.aggregate(**{
+            field: Count('id', filter=Q(rating=star))
+            for star, field in RATING_HISTOGRAM_FIELDS.items()
+        })
+        total = 0
+        for star, field in RATING_HISTOGRAM_FIELDS.items():
+            setattr(self, field, histogram[field])
+            total += star * histogram[field]
+        self.ratings_count = sum(histogram.values())
         if self.ratings_count > 0:
-            self.ratings_avg = sum(r.rating for r in ratings) / self.ratings_count
+            self.ratings_avg = total / self.ratings_count
         else:
             self.ratings_avg = 0.0
         self.save()
 
+class RatingQuerySet(models.QuerySet):
+    def upsert(self, movie_id, user, rating, review=None, set_review=True):
+        """
+        Insert or update ``user``'s rating of a movie and apply the stats change.
+
+        The rating row is written with INSERT ... ON CONFLICT (movie_id, user_id)
+        DO UPDATE ... RETURNING, which also yields the previous rating, so the movie
+        counters move by a delta instead of being recounted. With the default
+        sync stats mode the whole call is two statements on PostgreSQL, and
+        three on SQLite, which reads the previous rating first; a first rating
+        adds the trending-score write (users/trending.py) to the same
+        transaction. ``review`` is left untouched on update when ``set_review``
+        is False.
+
+        Returns ``(rating, movie, created)``; raises Movie.DoesNotExist for an
+        unknown movie. Must be called inside a transaction.
+        """
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        values = [movie_id, user.pk, rating, review, now, now]
+        table = self.model._meta.db_table
+
+        def upsert_sql(source, condition=''):
+            return f"""
+                INSERT INTO {table} (movie_id, user_id, rating, review, created_at, updated_at)
+                {source}
+                ON CONFLICT (movie_id, user_id) DO UPDATE SET
+                    rating = EXCLUDED.rating,
+                    review = CASE WHEN %s THEN EXCLUDED.review ELSE {table}.review END,
+                    updated_at = EXCLUDED.updated_at
+                {condition}
+                RETURNING id, movie_id, user_id, rating, review, created_at, updated_at
+            """
+
+        if connection.vendor == 'postgresql':
+            # The CTE locks and reads the existing row. Selecting the new values from it
+            # makes it run before the insert; read only from RETURNING it would run after
+            # the update and skip the row this statement just changed. The update only
+            # applies to a row the CTE saw, so a null old_rating always means an insert.
+            sql = f"""
+                WITH old AS (
+                    SELECT rating FROM {table} WHERE movie_id = %s AND user_id = %s FOR UPDATE
+                )
+                {upsert_sql(
+                    'SELECT %s, %s, %s, %s, %s, %s FROM (SELECT COUNT(*) FROM old) AS locked',
+                    'WHERE EXISTS (SELECT 1 FROM old)',
+                )},
+                    (SELECT rating FROM old) AS old_rating
+            """
+            for attempt in range(2):
+                obj = next(iter(self.raw(sql, [movie_id, user.pk] + values + [set_review])), None)
+                if obj is not None:
+                    break
+                # A concurrent request inserted the row after this statement's snapshot,
+                # so nothing was written. Run it again: the CTE now sees and locks that row.
+            else:
+                raise IntegrityError(f"Could not upsert rating of movie {movie_id}")
+            old = obj.old_rating
+        else:
+            # SQLite's RETURNING only sees new values and writers are serialized
+            # by the database lock, so read the previous rating first
+            old = self.filter(movie_id=movie_id, user=user).values_list('rating', flat=True).first()
+            obj = next(iter(self.raw(upsert_sql('VALUES (%s, %s, %s, %s, %s, %s)'), values + [set_review])))
+
+        delta = rating_histogram_delta(old, obj.rating)
+        if counters.is_enabled():
+            counters.add(movie_id, delta)
+            movie = movie_cache.get(movie_id)
+        elif outbox.is_deferred():
+            outbox.publish('rating.changed', movie_id)
+            movie = movie_cache.get(movie_id)
+        else:
+            movie = Movie.objects.apply_rating_delta_returning(movie_id, delta)
+            if movie is None:
+                raise Movie.DoesNotExist("Movie matching query does not exist.")
+
+        if old is None:
+            obj._record_created()
+        obj.movie = movie
+        obj.user = user
+        obj._stored_rating = obj.rating
+        return obj, movie, old is None
+
+
 class Rating(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='ratings')
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='ratings')
-    rating = models.IntegerField(
+    rating = models.SmallIntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
     review = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RatingQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
         unique_together = ['movie', 'user']  # One rating per user per movie
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='rating_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.movie.title}: {self.rating}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored value so sharded counters can apply a delta on save
+        instance._stored_rating = instance.__dict__.get('rating')
+        return instance
+
+    def _get_stored_rating(self):
+        if self._state.adding:
+            return None
+        if getattr(self, '_stored_rating', None) is None:
+            self._stored_rating = Rating.objects.filter(pk=self.pk).values_list('rating', flat=True).first()
+        return self._stored_rating
     
+    def _record_created(self):
+        # Feeds the trending scores (users/trending.py); call in the inserting transaction,
+        # which in sync outbox mode also applies the score update
+        outbox.publish('rating.created', self.movie_id, {'at': self.created_at.timestamp()})
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Update movie ratings stats when a rating is saved
-        self.movie.update_ratings_stats()
+        created = self._state.adding
+        if counters.is_enabled():
+            old = self._get_stored_rating()
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                counters.add(self.movie_id, rating_histogram_delta(old, self.rating))
+                if created:
+                    self._record_created()
+            self._stored_rating = self.rating
+            return
+        if outbox.is_deferred():
+            # Record the stats refresh in the same transaction; the outbox worker applies it
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                outbox.publish('rating.changed', self.movie_id)
+                if created:
+                    self._record_created()
+            return
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if created:
+                self._record_created()
+            # Update movie ratings stats when a rating is saved
+            self.movie.update_ratings_stats()
     
     def delete(self, *args, **kwargs):
+        if counters.is_enabled():
+            old = self._get_stored_rating()
+            with transaction.atomic():
+                result = super().delete(*args, **kwargs)
+                counters.add(self.movie_id, rating_histogram_delta(old, None))
+            return result
         movie = self.movie
-        super().delete(*args, **kwargs)
+        if outbox.is_deferred():
+            with transaction.atomic():
+                result = super().delete(*args, **kwargs)
+                outbox.publish('rating.changed', movie.id)
+            return result
+        result = super().delete(*args, **kwargs)
         # Update movie ratings stats when a rating is deleted
         movie.update_ratings_stats()
+        return result
+
+
+class OutboxEvent(models.Model):
+    """Pending side effect written in the same transaction as the change that caused it"""
+    topic = models.CharField(max_length=50)
+    key = models.CharField(max_length=64)  # events with the same topic and key are coalesced
+    payload = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
 
+    def __str__(self):
+        return f"{self.topic}:{self.key}"
+
+
+
+class MovieDeletion(models.Model):
+    """
+    Background deletion of a movie and its ratings, see users/deletion.py.
+
+    The movie is referenced by id only so the record outlives the row it deletes.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    movie_id = models.BigIntegerField(db_index=True)
+    movie_title = models.CharField(max_length=200)
+    requested_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='movie_deletions')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    ratings_total = models.PositiveIntegerField(default=0)
+    ratings_deleted = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'updated_at'])]
+
+    def __str__(self):
+        return f"Delete {self.movie_title} ({self.status})"
+
+
+class MovieTrendingScore(models.Model):
+    """Decayed rating velocity of a movie in log space, see users/trending.py"""
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    log_score = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=['log_score', 'movie'], name='trending_score_idx')]
+
+    def __str__(self):
+        return f"{self.movie_id}: {self.log_score:.3f}"
+
+
+class MovieRatingShard(models.Model):
+    """
+    One of N pending-delta rows per movie for sharded rating counters.
+
+    Writers add to a random shard instead of updating the movie row, and the
+    outbox worker folds the shards into the Movie counters and deletes them.
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='rating_shards')
+    shard = models.PositiveSmallIntegerField()
+    rating_1_delta = models.IntegerField(default=0)
+    rating_2_delta = models.IntegerField(default=0)
+    rating_3_delta = models.IntegerField(default=0)
+    rating_4_delta = models.IntegerField(default=0)
+    rating_5_delta = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['movie', 'shard']
+
+    def __str__(self):
+        return f"{self.movie_id}#{self.shard}"
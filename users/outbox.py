@@ -0,0 +1,71 @@
+"""
+Transactional outbox for side effects of writes.
+
+Writers call ``publish()`` inside their transaction. In ``deferred`` mode the
+event is stored as an ``OutboxEvent`` row and applied later by
+``manage.py run_outbox_worker``; in ``sync`` mode (the default) the handler
+runs at once, inside that same transaction, so a failing handler rolls the
+write back instead of losing the side effect after the commit.
+
+Handlers receive every pending event of their topic at once, grouped by key,
+so a burst of writes to one movie becomes a single piece of work.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+
+_handlers = {}
+
+
+def register(topic):
+    """Decorator registering ``func(events_by_key)`` as the handler for a topic"""
+    def decorator(func):
+        _handlers[topic] = func
+        return func
+    return decorator
+
+
+def is_deferred():
+    return getattr(settings, 'OUTBOX_MODE', 'sync') == 'deferred'
+
+
+def publish(topic, key, payload=None):
+    """Record an event for ``topic``; call inside the transaction making the change"""
+    payload = payload or {}
+    if is_deferred():
+        from .models import OutboxEvent
+        OutboxEvent.objects.create(topic=topic, key=str(key), payload=payload)
+    else:
+        dispatch(topic, {str(key): [payload]})
+
+
+def dispatch(topic, events_by_key):
+    _handlers[topic](events_by_key)
+
+
+def process_batch(batch_size=500):
+    """
+    Apply up to ``batch_size`` pending events and delete them.
+
+    Rows are claimed with SKIP LOCKED where the database supports it, so several
+    workers can drain the queue side by side. Returns the number of events handled.
+    """
+    from .models import OutboxEvent
+
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        grouped = defaultdict(lambda: defaultdict(list))
+        for event in events:
+            grouped[event.topic][event.key].append(event.payload)
+        for topic, events_by_key in grouped.items():
+            dispatch(topic, events_by_key)
+
+        OutboxEvent.objects.filter(id__in=[event.id for event in events]).delete()
+    return len(events)
@@ -0,0 +1,125 @@
+"""
+Optional PostgreSQL hash partitioning of the ratings table.
+
+With ``RATING_PARTITIONS = N`` (N > 0), users_rating is partitioned by
+HASH (movie_id) into users_rating_p0 ... p<N-1>. Each partition is vacuumed
+and has its indexes maintained on its own. All of a movie's ratings sit in
+one partition, so per-movie reads and the movie deletion job touch one
+partition only.
+
+The database still enforces (movie_id, user_id) uniqueness, because that key
+contains the partition key, so Rating.objects.upsert's ON CONFLICT is
+unchanged. PostgreSQL requires the primary key to include the partition key,
+so it becomes (id, movie_id). Django keeps treating ``id`` as the primary key.
+Ids come from a single sequence and stay unique; a lookup by id alone probes
+every partition's primary key index.
+
+``repartition()`` copies every row while holding an EXCLUSIVE lock. Reads
+continue, but rating writes wait until it commits. Run it through
+``manage.py partition_ratings`` in a quiet window; migrations never call it,
+so the schema they produce doesn't depend on the setting.
+"""
+import re
+
+
+PARTITION_KEY = 'movie_id'
+
+
+def partition_count(cursor, table):
+    """Number of hash partitions of ``table``; 0 for a plain table"""
+    cursor.execute(
+        """
+        SELECT COUNT(i.inhrelid) FROM pg_class c JOIN pg_inherits i ON i.inhparent = c.oid
+        WHERE c.oid = %s::regclass AND c.relkind = 'p'
+        """,
+        [table],
+    )
+    return cursor.fetchone()[0]
+
+
+def _constraints(cursor, table):
+    """Unique, foreign key, check and exclusion constraints: ``[(name, definition)]``"""
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('u', 'f', 'c', 'x') ORDER BY conname
+        """,
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def _indexes(cursor, table):
+    """Indexes that don't back a constraint: ``[(name, CREATE INDEX statement)]``"""
+    cursor.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass AND NOT EXISTS (
+            SELECT 1 FROM pg_constraint c
+            WHERE c.conrelid = x.indrelid AND c.conindid = x.indexrelid AND c.contype IN ('p', 'u', 'x')
+        )
+        ORDER BY i.relname
+        """,
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def repartition(cursor, table, partitions, key=PARTITION_KEY):
+    """
+    Rebuild ``table`` as ``partitions`` hash partitions on ``key``, or as a
+    plain table when ``partitions`` is 0. Columns, rows, constraints, indexes
+    and the id sequence are kept. Returns False when the table already has
+    that layout. Must run inside a transaction.
+    """
+    if partition_count(cursor, table) == partitions:
+        return False
+
+    new = f'{table}_new'
+    # Foreign key checks deferred earlier in the transaction would block DROP TABLE
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute(f'LOCK TABLE {table} IN EXCLUSIVE MODE')
+    constraints, indexes = _constraints(cursor, table), _indexes(cursor, table)
+
+    partition_by = f' PARTITION BY HASH ({key})' if partitions else ''
+    cursor.execute(f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS){partition_by}')
+    # The id default may point at the old table's sequence, which is dropped with it
+    cursor.execute(f'ALTER TABLE {new} ALTER COLUMN id DROP DEFAULT')
+    for remainder in range(partitions):
+        cursor.execute(
+            f'CREATE TABLE {new}_p{remainder} PARTITION OF {new} '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+        )
+    cursor.execute(f'INSERT INTO {new} SELECT * FROM {table}')
+
+    # Build keys and indexes before the swap so readers are blocked only briefly
+    primary_key = f'id, {key}' if partitions else 'id'
+    cursor.execute(f'ALTER TABLE {new} ADD CONSTRAINT {new}_pkey PRIMARY KEY ({primary_key})')
+    for name, definition in constraints:
+        cursor.execute(f'ALTER TABLE {new} ADD CONSTRAINT {name}_new {definition}')
+    for name, definition in indexes:
+        cursor.execute(re.sub(
+            r'^CREATE (UNIQUE )?INDEX \S+ ON (ONLY )?\S+ ',
+            lambda match: f'CREATE {match.group(1) or ""}INDEX {name}_new ON {new} ',
+            definition,
+        ))
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {new}')
+    cursor.execute(f'CREATE SEQUENCE {new}_id_seq START WITH {cursor.fetchone()[0]} OWNED BY {new}.id')
+    cursor.execute(f"ALTER TABLE {new} ALTER COLUMN id SET DEFAULT nextval('{new}_id_seq')")
+
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {new} RENAME TO {table}')
+    cursor.execute(f'ALTER SEQUENCE {new}_id_seq RENAME TO {table}_id_seq')
+    cursor.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {new}_pkey TO {table}_pkey')
+    for name, _ in constraints:
+        cursor.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {name}_new TO {name}')
+    for name, _ in indexes:
+        cursor.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+    for remainder in range(partitions):
+        cursor.execute(f'ALTER TABLE {new}_p{remainder} RENAME TO {table}_p{remainder}')
+    # Per-partition indexes were named after the partitions' temporary names
+    cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'i' AND starts_with(relname, %s)", [f'{new}_'])
+    for name, in cursor.fetchall():
+        cursor.execute(f'ALTER INDEX {name} RENAME TO {table}{name[len(new):]}')
+    cursor.execute(f'ANALYZE {table}')
+    return True
@@ -0,0 +1,122 @@
+"""
+Stored cProfile runs for ProfilingMiddleware.
+
+Each profiled request leaves ``<id>.prof`` (pstats, loadable with
+``python -m pstats`` or snakeviz) and ``<id>.json`` (request metadata and
+summary) in PROFILING["DIR"]; only the newest PROFILING["KEEP"] runs are kept.
+Ids start with the UTC capture time to the nanosecond, so sorting them by name
+orders runs by time.
+The directory is per host, so point it at shared storage when several hosts
+serve the API.
+"""
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    'DIR': 'profiles',
+    'KEEP': 200,
+    'TOP': 3,
+}
+
+PROFILE_ID_RE = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9]{9}-[0-9a-f]{8}$')
+
+_id_lock = threading.Lock()
+_last_ns = 0
+
+
+def new_profile_id():
+    """``<UTC second>-<nanoseconds>-<random>``, strictly increasing within this process"""
+    global _last_ns
+    with _id_lock:
+        _last_ns = max(time.time_ns(), _last_ns + 1)
+        ns = _last_ns
+    seconds, fraction = divmod(ns, 10 ** 9)
+    return f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(seconds))}-{fraction:09d}-{uuid.uuid4().hex[:8]}"
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def profile_dir():
+    directory = Path(options()['DIR'])
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def summarize(stats):
+    """One-line summary for the X-Profile-Summary header"""
+    top = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:options()['TOP']]
+    functions = ', '.join(
+        f"{func}({os.path.basename(filename)}:{line})={tottime * 1000:.1f}ms"
+        for (filename, line, func), (_, _, tottime, _, _) in top
+    )
+    return f"total={stats.total_tt * 1000:.1f}ms; calls={stats.total_calls}; top={functions}"
+
+
+def save(profiler, request, response, user):
+    """Store a finished profile; returns ``(profile_id, summary)``"""
+    directory = profile_dir()
+    profile_id = new_profile_id()
+    stats = pstats.Stats(profiler)
+    summary = summarize(stats)
+    stats.dump_stats(directory / f"{profile_id}.prof")
+    metadata = {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'user_id': user.pk,
+        'summary': summary,
+        'created_at': time.time(),
+    }
+    (directory / f"{profile_id}.json").write_text(json.dumps(metadata))
+    prune(directory)
+    return profile_id, summary
+
+
+def prune(directory):
+    runs = sorted(directory.glob('*.json'), reverse=True)
+    for stale in runs[options()['KEEP']:]:
+        stale.unlink(missing_ok=True)
+        stale.with_suffix('.prof').unlink(missing_ok=True)
+
+
+def list_profiles(limit=50):
+    """Metadata of the newest stored runs, newest first"""
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except FileNotFoundError:
+            continue  # pruned by a concurrent save since the listing
+        if len(profiles) == limit:
+            break
+    return profiles
+
+
+def profile_path(profile_id):
+    """Path of a stored .prof file; raises FileNotFoundError for unknown or malformed ids"""
+    if not PROFILE_ID_RE.match(profile_id):
+        raise FileNotFoundError(profile_id)
+    path = profile_dir() / f"{profile_id}.prof"
+    if not path.exists():
+        raise FileNotFoundError(profile_id)
+    return path
+
+
+def render_text(profile_id, sort='cumulative', limit=40):
+    stream = io.StringIO()
+    stats = pstats.Stats(str(profile_path(profile_id)), stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
@@ -0,0 +1,134 @@
+"""
+OpenAPI schema generated once per code version instead of on every request.
+
+``python manage.py build_openapi_schema`` writes the rendered schema to
+OPENAPI_SCHEMA_DIR at build time, with a manifest recording the code version
+and each file's checksum. CachedSpectacularAPIView serves that file only when
+the manifest matches the running code; otherwise it generates the schema on
+the first request. Either way the rendered bytes stay in memory with an ETag.
+
+The code version is SCHEMA_CODE_VERSION (the deploy commit), or else a digest
+of the project's Python sources, so any code change yields a new schema.
+"""
+import functools
+import hashlib
+import importlib
+import json
+import re
+import threading
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView
+
+
+RENDERERS = {
+    'yaml': OpenApiYamlRenderer,
+    'json': OpenApiJsonRenderer,
+}
+
+_rendered = {}
+_lock = threading.Lock()
+
+
+def code_version():
+    return getattr(settings, 'SCHEMA_CODE_VERSION', None) or source_digest()
+
+
+@functools.cache
+def source_digest():
+    """Digest of the project's own modules (apps and URLconf), minus migrations and tests"""
+    base = Path(settings.BASE_DIR).resolve()
+    roots = {Path(config.path).resolve() for config in apps.get_app_configs()}
+    roots.add(Path(importlib.import_module(settings.ROOT_URLCONF).__file__).resolve().parent)
+    digest = hashlib.sha256()
+    for root in sorted(root for root in roots if root.is_relative_to(base)):
+        for path in sorted(root.rglob('*.py')):
+            if 'migrations' in path.parts or path.name.startswith('test'):
+                continue
+            digest.update(str(path.relative_to(base)).encode() + b'\0' + path.read_bytes())
+    return f"src-{digest.hexdigest()[:16]}"
+
+
+def schema_path(fmt, version=None):
+    directory = Path(settings.OPENAPI_SCHEMA_DIR)
+    version = re.sub(r'[^\w.-]', '-', version or code_version())
+    return directory / f"schema-{version}.{fmt}"
+
+
+def manifest_path():
+    return Path(settings.OPENAPI_SCHEMA_DIR) / 'manifest.json'
+
+
+def write_manifest(version, bodies):
+    """Record which code version the prebuilt files belong to, with their checksums"""
+    checksums = {fmt: hashlib.sha256(body).hexdigest() for fmt, body in bodies.items()}
+    manifest_path().write_text(json.dumps({'version': version, 'sha256': checksums}, indent=2))
+
+
+def read_prebuilt(fmt, version):
+    """The prebuilt schema body, or None unless the manifest vouches for it for ``version``"""
+    try:
+        manifest = json.loads(manifest_path().read_text())
+        body = schema_path(fmt, version).read_bytes()
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != version:
+        return None
+    if manifest.get('sha256', {}).get(fmt) != hashlib.sha256(body).hexdigest():
+        return None
+    return body
+
+
+def generate_schema():
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return generator.get_schema(request=None, public=True)
+
+
+def render_schema(schema, fmt):
+    return RENDERERS[fmt]().render(schema, renderer_context={})
+
+
+def get_rendered_schema(fmt):
+    """Return ``(body, etag)`` for the current code version, building it at most once"""
+    version = code_version()
+    key = (version, fmt)
+    entry = _rendered.get(key)
+    if entry is not None:
+        return entry
+
+    with _lock:
+        entry = _rendered.get(key)
+        if entry is not None:
+            return entry
+        body = read_prebuilt(fmt, version)
+        if body is None:
+            body = render_schema(generate_schema(), fmt)
+        entry = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        # Older versions are dropped so a long-lived worker does not accumulate schemas
+        for stale in [k for k in _rendered if k[0] != version]:
+            del _rendered[stale]
+        _rendered[key] = entry
+        return entry
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    """SpectacularAPIView serving a prebuilt or memoized schema with ETag revalidation"""
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        fmt = 'json' if request.accepted_renderer.format == 'json' else 'yaml'
+        body, etag = get_rendered_schema(fmt)
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type=request.accepted_media_type)
+            response['Content-Disposition'] = f'inline; filename="{spectacular_settings.TITLE or "schema"}.{fmt}"'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+        return response
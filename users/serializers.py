@@ -1,9 +1,11 @@
 from rest_framework import serializers
-from . import models
+from . import models, trending
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt import serializers as jwt_serializers
+
+from .blacklist import BlacklistedRefreshToken
 
 User = get_user_model()
 
@@ -50,25 +52,104 @@ class UserLoginSerializer(serializers.Serializer):
         return data
 
 
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    token_class = BlacklistedRefreshToken
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    token_class = BlacklistedRefreshToken
+
+
 class UserDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.CustomUser
         fields = ('id', 'username', 'email')
         
 
-class MovieSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """
+    Lets callers pick output fields with ``?fields=a,b`` and/or ``?exclude=c``.
+
+    The chosen set travels in the serializer context as ``fieldset``, and
+    ``narrow_queryset`` turns it into the matching ``only()``/``select_related()``
+    so unrequested columns and joins are never loaded.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fieldset = self.context.get('fieldset')
+        if fieldset is not None:
+            for name in set(self.fields) - fieldset:
+                self.fields.pop(name)
+
+    @classmethod
+    def get_fieldset(cls, query_params):
+        """Return the requested field names, or None when the caller wants everything"""
+        fields = [name for name in query_params.get('fields', '').split(',') if name]
+        exclude = [name for name in query_params.get('exclude', '').split(',') if name]
+        if not fields and not exclude:
+            return None
+        available = list(cls.Meta.fields)
+        unknown = sorted(set(fields + exclude) - set(available))
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(unknown)}"})
+        return set(fields or available) - set(exclude)
+
+    @classmethod
+    def narrow_queryset(cls, queryset, fieldset):
+        """Restrict ``queryset`` to the columns and joins the fieldset needs"""
+        columns, joins = set(), set()
+        for field in cls(context={'fieldset': fieldset}).fields.values():
+            if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+                continue
+            parts = field.source.split('.')
+            if len(parts) > 1:
+                joins.add('__'.join(parts[:-1]))
+            columns.add('__'.join(parts))
+        queryset = queryset.select_related(None)
+        if joins:
+            queryset = queryset.select_related(*joins)
+        return queryset.only('pk', *columns)
+
+
+class GenreField(serializers.ChoiceField):
+    """Movie.genre is stored as a small-int code; the API reads and writes its label"""
+
+    def __init__(self, **kwargs):
+        super().__init__(choices=models.Movie.Genre.labels, **kwargs)
+
+    def to_internal_value(self, data):
+        return models.Movie.Genre.from_label(super().to_internal_value(data))
+
+    def to_representation(self, value):
+        return models.Movie.Genre(value).label
+
+
+class MovieSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    genre = GenreField()
     created_by_username = serializers.CharField(source='created_by.username', read_only=True)
+    my_rating = serializers.SerializerMethodField()
+
     class Meta:
         model = models.Movie
         fields = [
             'id', 'title', 'genre', 'release_year', 'description',
             'created_by', 'created_by_username', 'created_at', 'updated_at',
-            'ratings_count', 'ratings_avg'
+            'ratings_count', 'ratings_avg', 'my_rating'
         ]
         read_only_fields = ['created_by', 'created_by_username', 'created_at', 'updated_at', 'ratings_count', 'ratings_avg']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only present when the view looked up the caller's ratings (?include=my_rating)
+        if 'my_ratings' not in self.context:
+            self.fields.pop('my_rating', None)
 
-class RatingSerializer(serializers.ModelSerializer):
+    def get_my_rating(self, obj) -> int | None:
+        return self.context['my_ratings'].get(obj.pk)
+
+
+class RatingSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user_username = serializers.CharField(source='user.username', read_only=True)
     movie_title = serializers.CharField(source='movie.title', read_only=True)
     
@@ -81,15 +162,61 @@ class RatingSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'user_username', 'movie_title', 'created_at', 'updated_at']
 
 
+class RatingUpsertSerializer(serializers.Serializer):
+    """Input for rate_movie; omitting review keeps the existing one on update"""
+    rating = serializers.IntegerField(min_value=1, max_value=5)
+    review = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+
+class TrendingMovieSerializer(MovieSerializer):
+    trending_score = serializers.SerializerMethodField()
+
+    class Meta(MovieSerializer.Meta):
+        fields = MovieSerializer.Meta.fields + ['trending_score']
+
+    def get_trending_score(self, obj) -> float:
+        return round(trending.current_score(obj.trending.log_score), 4)
+
+
+class MovieDeletionSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.MovieDeletion
+        fields = [
+            'id', 'movie_id', 'movie_title', 'status', 'ratings_total', 'ratings_deleted',
+            'progress', 'error', 'created_at', 'updated_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
+    def get_progress(self, obj) -> float:
+        if obj.status == models.MovieDeletion.STATUS_COMPLETED:
+            return 1.0
+        if not obj.ratings_total:
+            return 0.0
+        # ratings_total is a snapshot; late ratings can push the deleted count past it
+        return round(min(obj.ratings_deleted / obj.ratings_total, 1.0), 4)
+
+
 class MovieDetailSerializer(MovieSerializer):
-    """Extended movie serializer with recent ratings"""
+    """Extended movie serializer with rating distribution and recent ratings"""
     recent_ratings = serializers.SerializerMethodField()
     
     class Meta(MovieSerializer.Meta):
-        fields = MovieSerializer.Meta.fields + ['recent_ratings']
+        fields = MovieSerializer.Meta.fields + list(models.RATING_HISTOGRAM_FIELDS.values()) + ['recent_ratings']
+        read_only_fields = MovieSerializer.Meta.read_only_fields + list(models.RATING_HISTOGRAM_FIELDS.values())
     
+    @staticmethod
+    def recent_ratings_queryset(movie):
+        # Of each rater only the username is loaded, so cached results hold no user rows
+        fields = [field.name for field in models.Rating._meta.concrete_fields]
+        return movie.ratings.select_related('user').only(*fields, 'user__username').order_by('-created_at')[:5]
+
     def get_recent_ratings(self, obj):
-        recent_ratings = obj.ratings.select_related('user').order_by('-created_at')[:5]
+        # get_movie_detail loads these with the movie, so coalesced requests share the query
+        recent_ratings = getattr(obj, 'recent_ratings', None)
+        if recent_ratings is None:
+            recent_ratings = self.recent_ratings_queryset(obj)
         return RatingSerializer(recent_ratings, many=True).data
 
         
\ No newline at end of file
@@ -0,0 +1,154 @@
+"""
+Single-flight coalescing of expensive reads, with optional stale-while-revalidate.
+
+``read_flight.run(key, compute)`` runs ``compute`` once for all of this
+worker's threads that ask for the same key at the same time. The others block
+until it finishes and get its result, or its exception. The result is shared
+between callers, so treat it as read-only.
+
+``read_flight.cached(key, compute)`` also caches the result in the Django cache
+``SINGLE_FLIGHT["ALIAS"]``:
+- An entry is fresh for TTL seconds.
+- For GRACE more seconds it is served stale while one caller recomputes it.
+- Only callers that find no entry at all wait for the computation.
+- With TTL 0 nothing is cached and only concurrent misses are coalesced.
+
+When LOCK_TIMEOUT is set and the cache is shared between workers, a
+recomputation also holds a lock key there (``cache.add``). Other workers then
+keep serving the stale entry, or wait for the new one on a cold miss, rather
+than running the same queries. The lock expires after LOCK_TIMEOUT seconds in
+case its holder dies; after that, waiting callers compute the value themselves.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    'TTL': 0,
+    'GRACE': 0,
+    'LOCK_TIMEOUT': 0,
+    'POLL_INTERVAL': 0.05,
+}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    key_prefix = 'flight:v1:'
+    lock_prefix = 'flight:lock:'
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(['computed', 'coalesced', 'fresh_hits', 'stale_hits', 'lock_waits'], 0)
+
+    @property
+    def options(self):
+        return {**DEFAULTS, **getattr(settings, 'SINGLE_FLIGHT', {})}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def run(self, key, compute):
+        """Return ``compute()``, sharing one call among concurrent callers with the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters['computed'] += 1
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = compute()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def run_exclusive(self, cache, key, compute, poll):
+        """
+        Return ``compute()`` run under the lock key for ``key`` in ``cache``.
+        If another worker holds the lock, wait for it to be released and
+        return ``poll()`` when that finds a value; otherwise compute anyway.
+        Without LOCK_TIMEOUT, or with a process-local cache, just computes.
+        """
+        options = self.options
+        if not options['LOCK_TIMEOUT'] or isinstance(cache, LocMemCache):
+            return compute()
+
+        lock_key = self.lock_prefix + key
+        if cache.add(lock_key, 1, options['LOCK_TIMEOUT']):
+            try:
+                return compute()
+            finally:
+                cache.delete(lock_key)
+
+        self._count('lock_waits')
+        deadline = time.monotonic() + options['LOCK_TIMEOUT']
+        while cache.get(lock_key) is not None and time.monotonic() < deadline:
+            time.sleep(options['POLL_INTERVAL'])
+        value = poll()
+        return compute() if value is None else value
+
+    def cached(self, key, compute):
+        """``compute()``'s result for ``key``, cached and recomputed as the module docstring describes"""
+        options = self.options
+        ttl = options['TTL']
+        if ttl <= 0:
+            return self.run(key, compute)
+
+        cache = caches[options['ALIAS']]
+        cache_key = self.key_prefix + key
+        entry = cache.get(cache_key)
+        if entry is not None:
+            fresh_until, value = entry
+            if fresh_until > time.time():
+                self._count('fresh_hits')
+                return value
+            # Stale: if the refresh is already running here or in another worker, don't wait for it
+            with self._lock:
+                refreshing = key in self._calls
+            if refreshing or (options['LOCK_TIMEOUT'] and cache.get(self.lock_prefix + key) is not None):
+                self._count('stale_hits')
+                return value
+
+        def refresh():
+            value = compute()
+            cache.set(cache_key, (time.time() + ttl, value), ttl + options['GRACE'])
+            return value
+
+        def poll():
+            entry = cache.get(cache_key)
+            return None if entry is None else entry[1]
+
+        return self.run(key, lambda: self.run_exclusive(cache, key, refresh, poll))
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, 'in_flight': len(self._calls)}
+
+
+read_flight = SingleFlight()
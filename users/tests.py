@@ -1,3 +1,1558 @@
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Avg, Count
+from django.db.migrations.state import ProjectState
+from django.db.models.deletion import Collector
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from django.test.utils import CaptureQueriesContext
+
+from drf_spectacular.settings import spectacular_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import blacklist, cache as cache_module, catalog, counters, deletion, middleware, outbox, partitioning, profiling, schema, singleflight, trending
+from .cache import movie_cache
+from .models import (
+    RATING_HISTOGRAM_FIELDS, CustomUser, Movie, MovieDeletion, MovieRatingShard, MovieTrendingScore, OutboxEvent, Rating,
+)
+from .serializers import MovieSerializer
+from .views import MOVIE_SORT_ORDERS
+
+
+def make_user(name):
+    return CustomUser.objects.create_user(f'{name}@example.com', name, 'pw')
+
+
+class AggregateAssertions:
+    def assertAggregatesExact(self):
+        """Every movie's count, average and per-star counters match its ratings"""
+        for movie in Movie.objects.all():
+            expected = Rating.objects.filter(movie=movie).aggregate(count=Count('id'), avg=Avg('rating'))
+            self.assertEqual(movie.ratings_count, expected['count'])
+            self.assertAlmostEqual(movie.ratings_avg, expected['avg'] or 0.0)
+            for star, field in RATING_HISTOGRAM_FIELDS.items():
+                self.assertEqual(
+                    getattr(movie, field),
+                    Rating.objects.filter(movie=movie, rating=star).count(),
+                )
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RatingHistogramTests(AggregateAssertions, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.raters = [make_user(f'rater{i}') for i in range(3)]
+        cls.movies = [
+            Movie.objects.create(title=f'Movie {i}', genre=Movie.Genre.DRAMA, release_year=2000 + i, created_by=cls.owner)
+            for i in range(3)
+        ]
+
+    def test_counters_follow_create_update_and_delete(self):
+        ratings = [
+            Rating.objects.create(movie=self.movies[0], user=user, rating=star)
+            for user, star in zip(self.raters, (5, 5, 2))
+        ]
+        self.assertAggregatesExact()
+        ratings[1].rating = 3
+        ratings[1].save()
+        self.assertAggregatesExact()
+        ratings[0].delete()
+        self.assertAggregatesExact()
+        self.movies[0].refresh_from_db()
+        self.assertEqual([getattr(self.movies[0], field) for field in RATING_HISTOGRAM_FIELDS.values()], [0, 1, 1, 0, 0])
+
+    def test_detail_exposes_histogram(self):
+        Rating.objects.create(movie=self.movies[1], user=self.raters[0], rating=4)
+        data = APIClient().get(f'/api/movies/{self.movies[1].id}/').json()
+        self.assertEqual([data[field] for field in RATING_HISTOGRAM_FIELDS.values()], [0, 0, 0, 1, 0])
+
+    def test_migration_backfill(self):
+        Rating.objects.bulk_create([
+            Rating(movie=movie, user=user, rating=(i + j) % 5 + 1)
+            for i, movie in enumerate(self.movies)
+            for j, user in enumerate(self.raters)
+        ])
+        for movie in self.movies:
+            movie.update_ratings_stats()
+        Movie.objects.update(**dict.fromkeys(RATING_HISTOGRAM_FIELDS.values(), 0))
+        migration = importlib.import_module('users.migrations.0003_movie_rating_histogram')
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            migration.backfill_rating_histogram(django_apps, None)
+        self.assertAggregatesExact()
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class OutboxTests(AggregateAssertions, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner, cls.rater = make_user('owner'), make_user('rater')
+        cls.movie = Movie.objects.create(title='Movie', genre=Movie.Genre.DRAMA, release_year=2000, created_by=cls.owner)
+
+    def setUp(self):
+        self.received = []
+        outbox.register('test.event')(self.received.append)
+        self.addCleanup(outbox._handlers.pop, 'test.event')
+
+    def test_sync_mode_dispatches_inside_the_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks, transaction.atomic():
+            outbox.publish('test.event', 7, {'n': 1})
+            self.assertEqual(self.received, [{'7': [{'n': 1}]}])
+        self.assertEqual(callbacks, [])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(OUTBOX_MODE='deferred')
+    def test_deferred_events_are_stored_and_coalesced_by_key(self):
+        for n in range(3):
+            outbox.publish('test.event', 7, {'n': n})
+        outbox.publish('test.event', 8)
+        self.assertEqual(OutboxEvent.objects.count(), 4)
+        self.assertEqual(self.received, [])
+        self.assertEqual(outbox.process_batch(), 4)
+        self.assertEqual(self.received, [{'7': [{'n': 0}, {'n': 1}, {'n': 2}], '8': [{}]}])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(OUTBOX_MODE='deferred')
+    def test_worker_drains_rating_stats(self):
+        Rating.objects.create(movie=self.movie, user=self.rater, rating=4)
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.ratings_count, 0)
+        call_command('run_outbox_worker', '--once', '--batch-size', '1', stdout=StringIO())
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertAggregatesExact()
+
+    @override_settings(OUTBOX_MODE='deferred')
+    def test_failed_batch_is_retried(self):
+        outbox.publish('test.event', 7)
+        failures = [RuntimeError('handler down')]
+
+        def flaky(events_by_key):
+            if failures:
+                raise failures.pop()
+            self.received.append(events_by_key)
+
+        outbox.register('test.event')(flaky)
+        with self.assertRaises(RuntimeError):
+            outbox.process_batch()
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+        self.assertEqual(outbox.process_batch(), 1)
+        self.assertEqual(self.received, [{'7': [{}]}])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], RATING_COUNTER_SHARDS=4)
+class ShardedCounterTests(AggregateAssertions, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.raters = [make_user(f'rater{i}') for i in range(8)]
+        cls.movies = [
+            Movie.objects.create(title=f'Movie {i}', genre=Movie.Genre.DRAMA, release_year=2000 + i, created_by=cls.owner)
+            for i in range(2)
+        ]
+
+    def test_fold_applies_the_summed_shard_deltas(self):
+        ratings = [
+            Rating.objects.create(movie=movie, user=user, rating=(i + j) % 5 + 1)
+            for i, movie in enumerate(self.movies)
+            for j, user in enumerate(self.raters)
+        ]
+        ratings[0].rating = ratings[0].rating % 5 + 1
+        ratings[0].save()
+        ratings[1].delete()
+        with transaction.atomic():
+            Rating.objects.upsert(self.movies[1].id, self.raters[0], 5)
+
+        # Writes only touched the shards; at most 4 per movie
+        self.assertFalse(Movie.objects.exclude(ratings_count=0).exists())
+        for movie in self.movies:
+            shards = MovieRatingShard.objects.filter(movie=movie)
+            self.assertLessEqual(shards.count(), 4)
+            for star, field in counters.DELTA_FIELDS.items():
+                pending = sum(getattr(shard, field) for shard in shards)
+                self.assertEqual(pending, movie.ratings.filter(rating=star).count())
+
+        self.assertEqual(counters.fold(), 2)
+        self.assertFalse(MovieRatingShard.objects.exists())
+        self.assertAggregatesExact()
+        self.assertEqual(counters.fold(), 0)
+
+    def test_fold_selected_movies(self):
+        for movie in self.movies:
+            counters.add(movie.id, {3: 2})
+        self.assertEqual(counters.fold([self.movies[0].id]), 1)
+        self.assertEqual(Movie.objects.get(id=self.movies[0].id).rating_3_count, 2)
+        self.assertTrue(MovieRatingShard.objects.filter(movie=self.movies[1]).exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RatingUpsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner, cls.rater = make_user('owner'), make_user('rater')
+        cls.movie = Movie.objects.create(title='Movie', genre=Movie.Genre.DRAMA, release_year=2000, created_by=cls.owner)
+
+    def rate(self, rating, **extra):
+        client = APIClient()
+        client.force_authenticate(self.rater)
+        return client.post(f'/api/movies/{self.movie.id}/ratings/', {'rating': rating, **extra}, format='json')
+
+    def histogram(self):
+        self.movie.refresh_from_db()
+        return [getattr(self.movie, field) for field in RATING_HISTOGRAM_FIELDS.values()]
+
+    def test_first_submit_creates_and_repeats_update(self):
+        self.assertEqual(self.rate(4, review='Good').status_code, 201)
+        response = self.rate(4)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['movie']['ratings_count'], 1)
+        self.assertEqual(Rating.objects.get().review, 'Good')  # omitted review is kept
+        self.assertEqual(self.histogram(), [0, 0, 0, 1, 0])
+
+    def test_rerate_moves_one_count_between_stars(self):
+        self.rate(2)
+        response = self.rate(5)
+        self.assertEqual(response.json()['movie'], {
+            'id': self.movie.id, 'title': 'Movie', 'ratings_count': 1, 'ratings_avg': 5.0,
+        })
+        self.assertEqual(self.histogram(), [0, 0, 0, 0, 1])
+
+    def test_unknown_movie(self):
+        client = APIClient()
+        client.force_authenticate(self.rater)
+        self.assertEqual(client.post('/api/movies/0/ratings/', {'rating': 3}).status_code, 404)
+
+    def test_statement_count(self):
+        # The upsert and the delta UPDATE, plus the trending score for a first rating;
+        # SQLite first reads the previous rating. Counted over the whole request,
+        # including anything run on commit.
+        upsert = 2 if connection.vendor == 'postgresql' else 3
+        for rating, status, statements in ((3, 201, upsert + 1), (1, 200, upsert)):
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.rate(rating).status_code, status)
+            sql = [query['sql'] for query in queries]
+            # The test's savepoint stands in for the request's BEGIN ... COMMIT
+            self.assertTrue(sql[0].startswith('SAVEPOINT') and sql[-1].startswith('RELEASE SAVEPOINT'))
+            self.assertEqual(len(sql) - 2, statements, sql)
+        self.assertEqual(self.histogram(), [1, 0, 0, 0, 0])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MovieCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.movie = Movie.objects.create(title='Movie', genre=Movie.Genre.DRAMA, release_year=2000, created_by=cls.owner)
+
+    def setUp(self):
+        movie_cache.invalidate(self.movie.id)
+        self.addCleanup(movie_cache.invalidate, self.movie.id)
+
+    def shared_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+        return override_settings(
+            CACHES={'default': settings.CACHES['default'], 'shared': shared},
+            MOVIE_CACHE={'SHARED_ALIAS': 'shared'},
+        )
+
+    def test_hit_after_first_load(self):
+        with self.assertNumQueries(1):
+            movie_cache.get(self.movie.id)
+        with self.assertNumQueries(0):
+            movie = movie_cache.get(self.movie.id)
+        self.assertEqual((movie.title, movie.created_by.username), ('Movie', 'owner'))
+        with self.assertRaises(Movie.DoesNotExist):
+            movie_cache.get(0)
+
+    def test_writes_invalidate(self):
+        movie_cache.get(self.movie.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Movie.objects.get(id=self.movie.id).save()  # Movie.save invalidates on commit
+            Rating.objects.create(movie=self.movie, user=self.owner, rating=4)
+        with self.assertNumQueries(1):
+            self.assertEqual(movie_cache.get(self.movie.id).ratings_count, 1)
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            Rating.objects.upsert(self.movie.id, self.owner, 2)
+        self.assertEqual(movie_cache.get(self.movie.id).ratings_avg, 2.0)
+
+    def test_shared_tier_holds_no_user_row(self):
+        with self.shared_cache():
+            movie_cache.get(self.movie.id)
+            stored = caches['shared'].get(f'{movie_cache.key_prefix}{self.movie.id}')
+            self.assertEqual(stored['created_by'], {'id': self.owner.id, 'username': 'owner'})
+            self.assertTrue(all(not isinstance(value, models.Model) for value in stored['movie'].values()))
+
+            # Another worker: empty local tier, served from the shared one
+            with self.assertNumQueries(0):
+                movie = cache_module.MovieCache().get(self.movie.id)
+            self.assertEqual(movie.title, 'Movie')
+            self.assertEqual((movie.created_by_id, movie.created_by.username), (self.owner.id, 'owner'))
+            self.assertTrue(movie_cache.stats()['shared_tier'])
+
+            movie_cache.invalidate(self.movie.id)
+            self.assertIsNone(caches['shared'].get(f'{movie_cache.key_prefix}{self.movie.id}'))
+
+
+class OpenApiSchemaTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.enterContext(override_settings(OPENAPI_SCHEMA_DIR=Path(directory), SCHEMA_CODE_VERSION='abc123'))
+        schema._rendered.clear()
+        self.addCleanup(schema._rendered.clear)
+
+    def get(self, **headers):
+        return APIClient().get('/api/schema/?format=json', headers=headers)
+
+    def test_etag_revalidation(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/api/movies/', json.loads(response.content)['paths'])
+        etag = response['ETag']
+        revalidated = self.get(If_None_Match=etag)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], etag)
+        self.assertEqual(self.get(If_None_Match='"other"').status_code, 200)
+
+    def test_prebuilt_file_is_served_without_generating(self):
+        call_command('build_openapi_schema', stdout=StringIO())
+        with mock.patch.object(schema, 'generate_schema', side_effect=AssertionError('generated')):
+            response = self.get()
+        self.assertEqual(response.content, schema.schema_path('json', 'abc123').read_bytes())
+
+    def test_mismatched_or_altered_prebuilt_file_is_refused(self):
+        call_command('build_openapi_schema', stdout=StringIO())
+        path = schema.schema_path('json', 'abc123')
+        path.write_bytes(path.read_bytes().replace(b'"openapi"', b'"altered"'))
+        self.assertIsNone(schema.read_prebuilt('json', 'abc123'))
+        self.assertIsNotNone(schema.read_prebuilt('yaml', 'abc123'))
+
+        with override_settings(SCHEMA_CODE_VERSION='def456'):
+            # A file left under the running version's name, from other code
+            schema.schema_path('json', 'def456').write_bytes(b'{}')
+            self.assertIsNone(schema.read_prebuilt('json', 'def456'))
+            self.assertIn(b'"paths"', self.get().content)
+
+    def test_version_falls_back_to_a_source_digest(self):
+        with override_settings(SCHEMA_CODE_VERSION=None):
+            version = schema.code_version()
+        self.assertRegex(version, r'^src-[0-9a-f]{16}$')
+        self.assertNotEqual(version, spectacular_settings.VERSION)
+
+
+
+class CompressionMiddlewareTests(TestCase):
+    body = json.dumps([{'id': i, 'title': f'Movie {i}'} for i in range(100)]).encode()
+
+    def respond(self, body=None, path='/api/movies/', accept='', etag=None, **options):
+        def get_response(request):
+            response = HttpResponse(self.body if body is None else body, content_type='application/json')
+            if etag:
+                response['ETag'] = etag
+            return response
+
+        with override_settings(COMPRESSION={'MIN_SIZE': 1024, 'EXCLUDE_PATHS': ['/api/auth/'], **options}):
+            compression = middleware.CompressionMiddleware(get_response)
+        return compression(RequestFactory().get(path, HTTP_ACCEPT_ENCODING=accept))
+
+    def test_gzip_when_brotli_is_unavailable(self):
+        with mock.patch.object(middleware, 'brotli', None):
+            response = self.respond(accept='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_brotli_preferred_unless_q_values_say_otherwise(self):
+        fake = mock.Mock(compress=lambda content, quality: b'br:' + content[:10])
+        with mock.patch.object(middleware, 'brotli', fake):
+            self.assertEqual(self.respond(accept='gzip, br')['Content-Encoding'], 'br')
+            self.assertEqual(self.respond(accept='*')['Content-Encoding'], 'br')
+            self.assertEqual(self.respond(accept='br;q=0.5, gzip')['Content-Encoding'], 'gzip')
+            self.assertEqual(self.respond(accept='*, br;q=0')['Content-Encoding'], 'gzip')
+
+    def test_identity_when_nothing_acceptable(self):
+        for accept in ('', 'identity', 'gzip;q=0, *;q=0'):
+            response = self.respond(accept=accept)
+            self.assertFalse(response.has_header('Content-Encoding'), accept)
+            self.assertEqual(response.content, self.body)
+            self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_small_and_excluded_bodies_are_left_alone(self):
+        small = self.respond(body=b'{"id": 1}', accept='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertFalse(small.has_header('Vary'))
+        self.assertTrue(self.respond(accept='gzip', MIN_SIZE=5).has_header('Content-Encoding'))
+        excluded = self.respond(path='/api/auth/login/', accept='gzip')
+        self.assertFalse(excluded.has_header('Content-Encoding'))
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_pages_outside_the_api_are_not_compressed(self):
+        self.client.force_login(CustomUser.objects.create_superuser('admin@example.com', 'admin', 'pw'))
+        # The changelist reflects ?q= next to the CSRF token, the setup BREACH needs
+        response = self.client.get('/admin/users/movie/?q=secret', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(response.content), 1024)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(self.respond(path='/admin/', accept='gzip').has_header('Content-Encoding'))
+
+    def test_strong_etag_is_weakened_and_keys_the_cache(self):
+        def get_response(request):
+            response = HttpResponse(self.body, content_type='application/json')
+            response['ETag'] = '"v1"'
+            return response
+
+        compression = middleware.CompressionMiddleware(get_response)
+        with mock.patch.object(middleware.gzip, 'compress', wraps=gzip.compress) as compress:
+            responses = [
+                compression(RequestFactory().get('/api/movies/', HTTP_ACCEPT_ENCODING='gzip')) for _ in range(3)
+            ]
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual({response['ETag'] for response in responses}, {'W/"v1"'})
+        self.assertEqual(gzip.decompress(responses[-1].content), self.body)
+
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ScopedMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser('admin@example.com', 'admin', 'pw')
+
+    def test_api_requests_skip_browser_middleware(self):
+        client = Client(enforce_csrf_checks=True)
+        client.cookies['sessionid'] = 'stale'
+        response = client.get('/api/movies/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Frame-Options'))
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertNotIn('sessionid', response.cookies)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+
+        # JWT-authenticated writes need no CSRF token under /api/
+        token = str(AccessToken.for_user(self.admin))
+        response = client.post(
+            '/api/movies/add/', {'title': 'Heat', 'genre': 'Drama', 'release_year': 1995},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_admin_keeps_sessions_and_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        login_page = client.get('/admin/login/')
+        self.assertEqual(login_page['X-Frame-Options'], 'DENY')
+        self.assertIn('csrftoken', login_page.cookies)
+
+        credentials = {'username': 'admin@example.com', 'password': 'pw', 'next': '/admin/'}
+        self.assertEqual(client.post('/admin/login/', credentials).status_code, 403)
+
+        credentials['csrfmiddlewaretoken'] = login_page.cookies['csrftoken'].value
+        response = client.post('/admin/login/', credentials)
+        self.assertRedirects(response, '/admin/', fetch_redirect_response=False)
+        self.assertIn('sessionid', response.cookies)
+        self.assertEqual(client.get('/admin/').status_code, 200)
+
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    JWT_BLACKLIST={'BATCH_SIZE': 3, 'FLUSH_INTERVAL': 3600},
+)
+class TokenBlacklistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('holder')
+
+    def setUp(self):
+        self.blacklist = self.enterContext(mock.patch.object(blacklist, 'token_blacklist', blacklist.TokenBlacklist()))
+
+    def shared_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        return override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+        )
+
+    def obtain(self):
+        response = APIClient().post('/api/auth/token/', {'email': 'holder@example.com', 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['refresh']
+
+    def refresh(self, token):
+        return APIClient().post('/api/auth/token/refresh/', {'refresh': token})
+
+    def assertRevoked(self, token):
+        jti = blacklist.BlacklistedRefreshToken(token, verify=False)['jti']
+        # Stored without waiting for a flush, and refused afterwards
+        self.assertTrue(BlacklistedToken.objects.filter(token__jti=jti, token__user=self.user).exists())
+        self.assertNotIn(jti, self.blacklist._pending_outstanding)
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_rotation_revokes_the_old_token(self):
+        old = self.obtain()
+        response = self.refresh(old)
+        self.assertEqual(response.status_code, 200)
+        self.assertRevoked(old)
+        self.assertEqual(self.refresh(response.json()['refresh']).status_code, 200)
+
+    def test_logout_revokes_the_token(self):
+        token = self.obtain()
+        self.assertEqual(APIClient().post('/api/auth/logout/', {'refresh': token}).status_code, 200)
+        self.assertRevoked(token)
+
+    def test_revocation_is_seen_by_other_workers(self):
+        token = blacklist.BlacklistedRefreshToken.for_user(self.user)
+        jti = token['jti']
+        worker_a, worker_b = blacklist.TokenBlacklist(), blacklist.TokenBlacklist()
+
+        # Process-local cache: every lookup reads the database
+        self.assertFalse(worker_b.contains(jti))
+        worker_a.add(token)
+        with self.assertNumQueries(1):
+            self.assertTrue(worker_b.contains(jti))
+
+        with self.shared_cache():
+            other = blacklist.BlacklistedRefreshToken.for_user(self.user)
+            self.assertFalse(worker_b.contains(other['jti']))  # Builds worker_b's filter before the revocation
+            worker_a.add(other)
+            with self.assertNumQueries(0):
+                self.assertTrue(worker_b.contains(other['jti']))
+            # A fresh worker after a restart finds it through its filter
+            cache.clear()
+            with self.assertNumQueries(2):
+                self.assertTrue(blacklist.TokenBlacklist().contains(other['jti']))
+
+    def test_purge_removes_expired_rows_in_chunks(self):
+        now = timezone.now()
+        tokens = OutstandingToken.objects.bulk_create([
+            OutstandingToken(jti=f'jti{i}', token=f'token{i}', user=self.user, expires_at=now + timedelta(hours=i - 4))
+            for i in range(7)
+        ])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token) for token in tokens[::2]])
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command('purge_expired_tokens', '--chunk-size', '2', '--pause', '0', stdout=StringIO())
+        self.assertEqual(sorted(OutstandingToken.objects.values_list('jti', flat=True)), ['jti5', 'jti6'])
+        self.assertEqual(list(BlacklistedToken.objects.values_list('token__jti', flat=True)), ['jti6'])
+        deletes = [q['sql'] for q in queries if q['sql'].startswith('DELETE FROM "token_blacklist_outstandingtoken"')]
+        self.assertEqual(len(deletes), 3)
+        # Expired token strings are never read back just to be deleted
+        self.assertFalse([q['sql'] for q in queries if '"token_blacklist_outstandingtoken"."token"' in q['sql']])
+
+    def test_outstanding_rows_are_batched(self):
+        tokens = [blacklist.BlacklistedRefreshToken.for_user(self.user) for _ in range(2)]
+        self.assertFalse(OutstandingToken.objects.exists())
+
+        # Blacklisting a buffered token writes its row at once and takes it out of the batch
+        self.blacklist.add(tokens[0])
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [tokens[0]['jti']])
+        self.assertEqual(list(self.blacklist._pending_outstanding), [tokens[1]['jti']])
+
+        tokens.append(blacklist.BlacklistedRefreshToken.for_user(self.user))
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        tokens.append(blacklist.BlacklistedRefreshToken.for_user(self.user))  # Third buffered row fills the batch
+        self.assertEqual(OutstandingToken.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(self.blacklist._pending_outstanding, {})
+
+        last = blacklist.BlacklistedRefreshToken.for_user(self.user)
+        self.blacklist.flush()
+        self.assertTrue(OutstandingToken.objects.filter(jti=last['jti'], user=self.user).exists())
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.movie = Movie.objects.create(
+            title='Movie', genre=Movie.Genre.DRAMA, release_year=2000, description='Long text', created_by=cls.owner,
+        )
+        Rating.objects.create(movie=cls.movie, user=cls.owner, rating=4, review='Fine')
+
+    def setUp(self):
+        movie_cache.invalidate(self.movie.id)
+        self.addCleanup(movie_cache.invalidate, self.movie.id)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(url)
+        return response, [query['sql'] for query in queries]
+
+    def test_list_narrows_output_and_columns(self):
+        response, queries = self.get('/api/movies/?fields=id,title,genre,ratings_avg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['items'][0]), {'id', 'title', 'genre', 'ratings_avg'})
+        sql = ' '.join(queries)
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('JOIN', sql)
+
+        response, queries = self.get('/api/movies/?exclude=description,created_by_username,updated_at')
+        sql = ' '.join(queries)
+        expected = set(MovieSerializer.Meta.fields) - {'description', 'created_by_username', 'updated_at', 'my_rating'}
+        self.assertEqual(set(response.json()['items'][0]), expected)
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('"users_customuser"', sql)
+
+        # The default set still joins for created_by_username
+        response, queries = self.get('/api/movies/')
+        sql = ' '.join(queries)
+        self.assertEqual(response.json()['items'][0]['created_by_username'], 'owner')
+        self.assertIn('"description"', sql)
+        self.assertIn('"users_customuser"', sql)
+
+    def test_ratings_join_only_what_is_asked_for(self):
+        response, queries = self.get(f'/api/movies/{self.movie.id}/ratings/?fields=rating,user_username')
+        self.assertEqual(response.json()['items'], [{'rating': 4, 'user_username': 'owner'}])
+        [sql] = [query for query in queries if query.startswith('SELECT "users_rating"."id"')]
+        self.assertNotIn('"review"', sql)
+        self.assertIn('JOIN "users_customuser"', sql)
+        self.assertNotIn('JOIN "users_movie"', sql)
+
+    def test_detail_skips_recent_ratings_when_excluded(self):
+        response, queries = self.get(f'/api/movies/{self.movie.id}/?exclude=recent_ratings')
+        self.assertNotIn('recent_ratings', response.json())
+        self.assertNotIn('"users_rating"', ' '.join(queries))
+        response, _ = self.get(f'/api/movies/{self.movie.id}/?fields=id,recent_ratings')
+        self.assertEqual(set(response.json()), {'id', 'recent_ratings'})
+        self.assertEqual(response.json()['recent_ratings'][0]['rating'], 4)
+
+    def test_unknown_fields_are_rejected(self):
+        for query in ('fields=id,bogus', 'exclude=nope', 'fields=recent_ratings'):
+            response = APIClient().get(f'/api/movies/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('Unknown field', response.json()['fields'])
+        response = APIClient().get(f'/api/movies/{self.movie.id}/ratings/?exclude=title')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserDeletionTests(AggregateAssertions, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.movies = [
+            Movie.objects.create(title=f'Movie {i}', genre=Movie.Genre.DRAMA, release_year=2000 + i, created_by=cls.owner)
+            for i in range(6)
+        ]
+        cls.raters = [make_user(f'rater{i}') for i in range(4)]
+        Rating.objects.bulk_create([
+            Rating(movie=movie, user=user, rating=(i + j) % 5 + 1)
+            for i, movie in enumerate(cls.movies)
+            for j, user in enumerate(cls.raters)
+        ])
+        for movie in cls.movies:
+            movie.update_ratings_stats()
+
+    def test_instance_delete_keeps_aggregates_exact(self):
+        user_id = self.raters[0].id
+        self.raters[0].delete()
+        self.assertFalse(Rating.objects.filter(user_id=user_id).exists())
+        self.assertAggregatesExact()
+
+    def test_queryset_delete_keeps_aggregates_exact(self):
+        CustomUser.objects.filter(id__in=[self.raters[1].id, self.raters[2].id]).delete()
+        self.assertEqual(Rating.objects.count(), len(self.movies) * 2)
+        self.assertAggregatesExact()
+
+    def test_deleting_every_rater_zeroes_stats(self):
+        CustomUser.objects.filter(id__in=[user.id for user in self.raters]).delete()
+        self.assertAggregatesExact()
+        self.assertFalse(Movie.objects.exclude(ratings_count=0).exists())
+
+    @override_settings(RATING_DELETE_CHUNK_SIZE=4)
+    def test_chunked_delete_keeps_aggregates_exact(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.raters[3].delete()
+        self.assertAggregatesExact()
+        # Two chunks of at most four, each one DELETE without first loading the rows
+        chunks = [q for q in queries if q['sql'].startswith('DELETE FROM "users_rating" WHERE "users_rating"."id" IN')]
+        self.assertEqual(len(chunks), 2)
+        self.assertFalse([q for q in queries if '"users_rating"."review"' in q['sql']])
+
+    @override_settings(RATING_DELETE_CHUNK_SIZE=1000)
+    def test_query_count_does_not_grow_with_history(self):
+        light, heavy = make_user('light'), make_user('heavy')
+        Rating.objects.create(movie=self.movies[0], user=light, rating=4)
+        Rating.objects.bulk_create([Rating(movie=movie, user=heavy, rating=2) for movie in self.movies])
+        for movie in self.movies:
+            movie.update_ratings_stats()
+
+        with CaptureQueriesContext(connection) as light_queries:
+            light.delete()
+        with CaptureQueriesContext(connection) as heavy_queries:
+            heavy.delete()
+        self.assertEqual(len(light_queries), len(heavy_queries))
+        self.assertAggregatesExact()
+
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MovieDeletionTests(AggregateAssertions, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.raters = [make_user(f'rater{i}') for i in range(5)]
+        cls.movie, cls.other = [
+            Movie.objects.create(title=f'Movie {i}', genre=Movie.Genre.DRAMA, release_year=2000 + i, created_by=cls.owner)
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.start = self.enterContext(mock.patch.object(deletion, 'start_in_background'))
+        for movie in (self.movie, self.other):
+            movie_cache.invalidate(movie.id)
+            self.addCleanup(movie_cache.invalidate, movie.id)
+
+    def rate_both(self):
+        for i, user in enumerate(self.raters):
+            for movie in (self.movie, self.other):
+                Rating.objects.create(movie=movie, user=user, rating=i % 5 + 1)
+
+    def request_deletion(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/movies/{self.movie.id}/')
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def test_accepted_job_reports_its_real_state(self):
+        self.rate_both()
+        job = self.request_deletion()
+        self.assertEqual((job['status'], job['progress'], job['ratings_total']), ('pending', 0.0, 5))
+        # Handed off, not run in the request
+        self.start.assert_called_once_with(job['id'])
+        self.assertEqual(Rating.objects.filter(movie_id=self.movie.id).count(), 5)
+        self.assertEqual(self.client.get(f'/api/movies/{self.movie.id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/movies/deletions/{job["id"]}/').json()['status'], 'pending')
+
+        self.assertTrue(deletion.run_claimed(job['id']))
+        self.assertFalse(deletion.run_claimed(job['id']))
+        status = self.client.get(f'/api/movies/deletions/{job["id"]}/').json()
+        self.assertEqual((status['status'], status['progress'], status['ratings_deleted']), ('completed', 1.0, 5))
+        self.assertFalse(Movie.objects.filter(id=self.movie.id).exists())
+        self.assertFalse(Rating.objects.filter(movie_id=self.movie.id).exists())
+        self.assertAggregatesExact()
+
+    @override_settings(RATING_DELETE_CHUNK_SIZE=2)
+    def test_ratings_are_deleted_in_chunks(self):
+        self.rate_both()
+        job = self.request_deletion()
+        with CaptureQueriesContext(connection) as queries:
+            deletion.run_claimed(job['id'])
+        # Three chunks by id; the movie's own cascade afterwards finds nothing left
+        chunks = [query for query in queries if query['sql'].startswith('DELETE FROM "users_rating" WHERE "users_rating"."id" IN')]
+        self.assertEqual(len(chunks), 3)
+        # Each chunk is deleted without loading its rows; a delete signal or a model
+        # referencing Rating would make the collector fetch them first
+        self.assertTrue(Collector(using='default').can_fast_delete(Rating.objects.all()))
+        self.assertFalse([query for query in queries if '"users_rating"."review"' in query['sql']])
+        self.assertEqual(MovieDeletion.objects.get(id=job['id']).ratings_deleted, 5)
+
+    @override_settings(OUTBOX_MODE='deferred')
+    def test_deferred_mode_leaves_the_job_to_the_worker(self):
+        job = self.request_deletion()
+        self.start.assert_not_called()
+        self.assertEqual(deletion.process_pending(), 1)
+        self.assertEqual(MovieDeletion.objects.get(id=job['id']).status, MovieDeletion.STATUS_COMPLETED)
+
+    @override_settings(RATING_COUNTER_SHARDS=4)
+    def test_pending_shards_go_with_the_movie(self):
+        self.rate_both()
+        job = self.request_deletion()
+        # Hidden movies take no new ratings while their old ones are removed
+        response = self.client.post(f'/api/movies/{self.movie.id}/ratings/', {'rating': 3})
+        self.assertEqual(response.status_code, 404)
+        deletion.run_claimed(job['id'])
+        self.assertFalse(MovieRatingShard.objects.filter(movie_id=self.movie.id).exists())
+        self.assertEqual(counters.fold(), 1)
+        self.assertAggregatesExact()
+
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MovieDeletionThreadTests(TransactionTestCase):
+    def test_sync_mode_deletes_after_responding(self):
+        owner = make_user('owner')
+        movie = Movie.objects.create(title='Movie', genre=Movie.Genre.DRAMA, release_year=2000, created_by=owner)
+        Rating.objects.create(movie=movie, user=owner, rating=4)
+        self.addCleanup(movie_cache.invalidate, movie.id)
+        client = APIClient()
+        client.force_authenticate(owner)
+
+        response = client.delete(f'/api/movies/{movie.id}/')
+        self.assertEqual((response.status_code, response.json()['status']), (202, 'pending'))
+        jobs = MovieDeletion.objects.filter(id=response.json()['id'])
+        deadline = time.monotonic() + 5
+        while jobs.get().status != MovieDeletion.STATUS_COMPLETED and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(jobs.get().status, MovieDeletion.STATUS_COMPLETED)
+        self.assertFalse(Rating.objects.exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AdminQueryCountTests(TestCase):
+    """Admin pages must issue the same number of queries however many rows exist"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = CustomUser.objects.create_superuser('admin@example.com', 'admin', 'pw')
+        cls.movie = Movie.objects.create(title='Seed', genre=Movie.Genre.DRAMA, release_year=1999, created_by=cls.admin_user)
+        cls.rating = Rating.objects.create(movie=cls.movie, user=cls.admin_user, rating=5)
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def add_rows(self, n):
+        start = CustomUser.objects.count()
+        users = [make_user(f'bulk{start + i}') for i in range(n)]
+        movies = Movie.objects.bulk_create([
+            Movie(title=f'Bulk {start + i}', genre=Movie.Genre.ACTION, release_year=2000, created_by=user)
+            for i, user in enumerate(users)
+        ])
+        Rating.objects.bulk_create([
+            Rating(movie=movie, user=user, rating=3) for movie in movies for user in users[:3]
+        ])
+        return users
+
+    def query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def assertConstantQueries(self, url):
+        self.query_count(url)  # warm per-process caches (content types, sessions)
+        before, _ = self.query_count(url)
+        users = self.add_rows(15)
+        after, response = self.query_count(url)
+        self.assertEqual(before, after)
+        return users, response
+
+    def test_changelists(self):
+        for model in ('customuser', 'movie', 'rating'):
+            with self.subTest(model=model):
+                self.assertConstantQueries(reverse(f'admin:users_{model}_changelist'))
+
+    def test_searches_and_filters(self):
+        past_week = urlencode({'q': 'bulk', 'created_at__gte': timezone.now() - timedelta(days=7)})
+        urls = [
+            reverse('admin:users_customuser_changelist') + '?q=bulk',
+            reverse('admin:users_movie_changelist') + f'?{past_week}',
+            reverse('admin:users_rating_changelist') + f'?{past_week}&rating=3',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+    def test_change_forms_do_not_list_related_rows(self):
+        urls = [
+            reverse('admin:users_customuser_change', args=[self.admin_user.pk]),
+            reverse('admin:users_movie_change', args=[self.movie.pk]),
+            reverse('admin:users_rating_change', args=[self.rating.pk]),
+            reverse('admin:users_movie_add'),
+            reverse('admin:users_rating_add'),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                users, response = self.assertConstantQueries(url)
+                self.assertNotContains(response, users[-1].email)
+
+    def test_user_form_loads_permissions_in_one_query(self):
+        url = reverse('admin:users_customuser_change', args=[self.admin_user.pk])
+        self.query_count(url)
+        count, _ = self.query_count(url)
+        self.assertLess(count, 15)
+
+    def test_filters_never_scan_for_distinct_values(self):
+        for model in ('customuser', 'movie', 'rating'):
+            with self.subTest(model=model):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse(f'admin:users_{model}_changelist'))
+                self.assertFalse([q['sql'] for q in queries if 'DISTINCT' in q['sql']])
+        self.add_rows(2)
+        _, response = self.query_count(reverse('admin:users_rating_changelist') + '?rating=3')
+        self.assertEqual({rating.rating for rating in response.context['cl'].result_list}, {3})
+        self.assertContains(response, '?rating=5')
+
+    def test_changelist_skips_full_count(self):
+        _, response = self.query_count(reverse('admin:users_rating_changelist') + '?q=seed')
+        self.assertIsNone(response.context['cl'].full_result_count)
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = make_user('owner')
+        titles = ['the Matrix', 'The Thing', 'Thelma', 'Alien', 'Them!', 'Other']
+        cls.movies = {
+            title: Movie.objects.create(title=title, genre=Movie.Genre.DRAMA, release_year=1980 + i, created_by=owner)
+            for i, title in enumerate(titles)
+        }
+
+    def autocomplete(self, query):
+        response = APIClient().get('/api/movies/autocomplete/' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_case_insensitive_prefix_in_title_order(self):
+        items = self.autocomplete('?q=tHe')
+        self.assertEqual([item['title'] for item in items], ['the Matrix', 'The Thing', 'Thelma', 'Them!'])
+        self.assertEqual(set(items[0]), {'id', 'title', 'release_year'})
+
+    def test_limit_and_empty_query(self):
+        self.assertEqual(len(self.autocomplete('?q=the&limit=2')), 2)
+        self.assertEqual(self.autocomplete('?q='), [])
+
+    def test_movies_pending_deletion_are_hidden(self):
+        Movie.objects.filter(id=self.movies['Thelma'].id).update(pending_deletion=True)
+        self.assertNotIn('Thelma', [item['title'] for item in self.autocomplete('?q=thel')])
+
+    @skipUnless(connection.vendor == 'sqlite', 'plan text is SQLite specific')
+    def test_prefix_query_is_an_index_range_scan(self):
+        plan = Movie.objects.visible().title_prefix('th').values_list('id', 'title', 'release_year')[:10].explain()
+        self.assertIn('users_movie_title_prefix_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class ListMoviesSortAndRangeTests(TestCase):
+    FILTERS = {
+        'none': '',
+        'genre': 'genre=drama',
+        'search': 'search=mov',
+        'year': 'min_year=1990&max_year=2010',
+        'rating': 'min_rating=2&max_rating=4',
+        'count': 'min_ratings_count=2',
+        'all': 'genre=drama&min_year=1990&max_year=2010&min_rating=2&max_rating=4&min_ratings_count=2',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = make_user('owner')
+        Movie.objects.bulk_create([
+            Movie(
+                title=f'Movie {i:02}', genre=Movie.Genre.DRAMA if i % 2 else Movie.Genre.ACTION, release_year=1980 + i,
+                created_by=owner, ratings_count=i % 7, ratings_avg=(i % 5) + 0.5,
+            )
+            for i in range(40)
+        ])
+
+    def list_movies(self, query):
+        response = APIClient().get('/api/movies/?limit=50&' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['items']
+
+    def test_range_filters(self):
+        items = self.list_movies(self.FILTERS['all'])
+        self.assertTrue(items)
+        for item in items:
+            self.assertEqual(item['genre'], 'Drama')
+            self.assertTrue(1990 <= item['release_year'] <= 2010)
+            self.assertTrue(2 <= item['ratings_avg'] <= 4)
+            self.assertGreaterEqual(item['ratings_count'], 2)
+
+    def test_sort_orders(self):
+        keys = {
+            'rating': lambda item: -item['ratings_avg'],
+            'count': lambda item: -item['ratings_count'],
+            'year': lambda item: -item['release_year'],
+            'title': lambda item: item['title'],
+        }
+        for sort, key in keys.items():
+            with self.subTest(sort=sort):
+                items = self.list_movies(f'sort={sort}')
+                self.assertEqual([key(item) for item in items], sorted(key(item) for item in items))
+
+    def test_unknown_sort_is_rejected(self):
+        response = APIClient().get('/api/movies/?sort=random')
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'plan text is SQLite specific')
+    def test_every_sort_and_filter_combination_uses_an_index_order(self):
+        for sort in MOVIE_SORT_ORDERS:
+            for name, query in self.FILTERS.items():
+                with self.subTest(sort=sort, filters=name):
+                    with CaptureQueriesContext(connection) as queries:
+                        self.list_movies(f'sort={sort}&{query}')
+                    page_sql = next(q['sql'] for q in queries if 'ORDER BY' in q['sql'])
+                    with connection.cursor() as cursor:
+                        cursor.execute('EXPLAIN QUERY PLAN ' + page_sql)
+                        plan = ' | '.join(row[-1] for row in cursor.fetchall())
+                    self.assertIn('USING INDEX', plan)
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MyRatingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner, cls.rater = make_user('owner'), make_user('rater')
+        cls.movies = Movie.objects.bulk_create([
+            Movie(title=f'Movie {i:02}', genre=Movie.Genre.DRAMA, release_year=1990 + i, created_by=cls.owner)
+            for i in range(12)
+        ])
+        for movie in cls.movies[:6]:
+            Rating.objects.create(movie=movie, user=cls.rater, rating=1 + movie.pk % 5)
+        Rating.objects.create(movie=cls.movies[0], user=cls.owner, rating=5)
+
+    def get(self, url, user=None):
+        client = APIClient()
+        if user:
+            client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_list_attaches_caller_ratings_in_one_query(self):
+        for enabled in (True, False):
+            with self.subTest(catalog=enabled), override_settings(MOVIE_CATALOG={'ENABLED': enabled}):
+                catalog.movie_catalog.invalidate()
+                self.get('/api/movies/?limit=50&sort=year', self.rater)  # warm the snapshot
+                plain, plain_queries = self.get('/api/movies/?limit=50&sort=year', self.rater)
+                data, queries = self.get('/api/movies/?limit=50&sort=year&include=my_rating', self.rater)
+                self.assertEqual(queries, plain_queries + 1)
+                self.assertNotIn('my_rating', plain['items'][0])
+                expected = {movie.pk: 1 + movie.pk % 5 for movie in self.movies[:6]}
+                self.assertEqual({item['id']: item['my_rating'] for item in data['items']},
+                                 {movie.pk: expected.get(movie.pk) for movie in self.movies})
+        catalog.movie_catalog.invalidate()
+
+    def test_detail_and_anonymous_callers(self):
+        movie = self.movies[0]
+        data, _ = self.get(f'/api/movies/{movie.pk}/?include=my_rating', self.owner)
+        self.assertEqual(data['my_rating'], 5)
+        data, _ = self.get('/api/movies/?include=my_rating&fields=id,my_rating')
+        self.assertEqual({item['my_rating'] for item in data['items']}, {None})
+        # Leaving my_rating out of the fieldset skips the lookup
+        _, without = self.get('/api/movies/?include=my_rating&fields=id', self.rater)
+        _, plain = self.get('/api/movies/?fields=id', self.rater)
+        self.assertEqual(without, plain)
+
+    def test_unknown_include_is_rejected(self):
+        response = APIClient().get('/api/movies/?include=everything')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.flight = singleflight.SingleFlight()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def start(self, target, count=1):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def test_concurrent_callers_share_one_computation(self):
+        release, calls, results = threading.Event(), [], []
+
+        def compute():
+            calls.append(1)
+            release.wait()
+            return ['page']
+
+        threads = self.start(lambda: results.append(self.flight.run('k', compute)))
+        self.wait_until(lambda: calls)
+        threads += self.start(lambda: results.append(self.flight.run('k', compute)), count=7)
+        self.wait_until(lambda: self.flight.stats()['coalesced'] == 7)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(self.flight.stats()['in_flight'], 0)
+
+    def test_stale_entry_is_served_while_one_caller_refreshes(self):
+        cache.set(self.flight.key_prefix + 'k', (time.time() - 1, 'old'), 60)
+        release, results = threading.Event(), []
+
+        def compute():
+            release.wait()
+            return 'new'
+
+        with override_settings(SINGLE_FLIGHT={'TTL': 60, 'GRACE': 60}):
+            threads = self.start(lambda: results.append(self.flight.cached('k', compute)))
+            self.wait_until(lambda: self.flight.stats()['in_flight'])
+            self.assertEqual(self.flight.cached('k', compute), 'old')
+            release.set()
+            threads[0].join()
+            self.assertEqual(results, ['new'])
+            self.assertEqual(self.flight.cached('k', compute), 'new')
+        self.assertEqual(self.flight.stats()['stale_hits'], 1)
+        self.assertEqual(self.flight.stats()['fresh_hits'], 1)
+
+    def test_other_workers_wait_on_the_lock_key(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+        with override_settings(
+            CACHES={'default': settings.CACHES['default'], 'shared': shared},
+            SINGLE_FLIGHT={'ALIAS': 'shared', 'TTL': 60, 'LOCK_TIMEOUT': 5, 'POLL_INTERVAL': 0.01},
+        ):
+            other_worker = caches['shared']
+            other_worker.add(self.flight.lock_prefix + 'k', 1, 5)
+
+            def finish():
+                time.sleep(0.05)
+                other_worker.set(self.flight.key_prefix + 'k', (time.time() + 60, 'theirs'), 60)
+                other_worker.delete(self.flight.lock_prefix + 'k')
+
+            self.start(finish)
+            self.assertEqual(self.flight.cached('k', lambda: self.fail('computed twice')), 'theirs')
+        self.assertEqual(self.flight.stats()['lock_waits'], 1)
+
+    def test_list_movies_page_is_cached_within_ttl(self):
+        owner = make_user('owner')
+        Movie.objects.bulk_create([
+            Movie(title=f'Movie {i}', genre=Movie.Genre.DRAMA, release_year=2000 + i, created_by=owner)
+            for i in range(3)
+        ])
+        with override_settings(SINGLE_FLIGHT={'TTL': 60}, MOVIE_CATALOG={'ENABLED': False}):
+            first = APIClient().get('/api/movies/?sort=year')
+            with CaptureQueriesContext(connection) as queries:
+                second = APIClient().get('/api/movies/?sort=year')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(first.json(), second.json())
+
+    def test_cached_reads_hold_no_password_hashes(self):
+        owner, rater = make_user('owner'), make_user('rater')
+        movie = Movie.objects.create(title='Movie', genre=Movie.Genre.DRAMA, release_year=2000, created_by=owner)
+        Rating.objects.create(movie=movie, user=rater, rating=4)  # Also scores it for the trending feed
+        movie_cache.invalidate(movie.id)
+        with override_settings(SINGLE_FLIGHT={'TTL': 60}, MOVIE_CATALOG={'ENABLED': False}):
+            for url in ('/api/movies/', '/api/movies/trending/', f'/api/movies/{movie.id}/'):
+                response = APIClient().get(url)
+                self.assertEqual(response.status_code, 200)
+        movie_cache.invalidate(movie.id)
+        entries = list(cache._cache.values())  # LocMemCache keeps pickled values
+        self.assertGreaterEqual(len(entries), 3)
+        for user in (owner, rater):
+            self.assertFalse(any(user.password.encode() in entry for entry in entries))
+        self.assertIn(b'rater', b''.join(entries))
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_user('staff@example.com', 'staff', 'pw', is_staff=True)
+        cls.user = make_user('regular')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(PROFILING={'DIR': directory, 'KEEP': 2})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get(self, url, user, **headers):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}', **headers)
+
+    def test_staff_request_is_profiled_and_retrievable(self):
+        response = self.get('/api/movies/', self.staff, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total=', response['X-Profile-Summary'])
+        profile_id = response['X-Profile-Id']
+
+        listing = self.get('/api/system/profiles/', self.staff).json()
+        self.assertEqual([run['id'] for run in listing], [profile_id])
+        self.assertEqual(listing[0]['path'], '/api/movies/')
+
+        artifact = self.get(f'/api/system/profiles/{profile_id}/', self.staff)
+        self.assertEqual(artifact.status_code, 200)
+        self.assertTrue(b''.join(artifact.streaming_content))
+        report = self.get(f'/api/system/profiles/{profile_id}/?report=1', self.staff)
+        self.assertContains(report, 'function calls')
+
+    def test_query_flag_and_retention(self):
+        ids = [self.get('/api/?_profile=1', self.staff)['X-Profile-Id'] for _ in range(3)]
+        listed = [run['id'] for run in self.get('/api/system/profiles/', self.staff).json()]
+        self.assertEqual(listed, ids[:0:-1])
+
+    def test_ids_follow_capture_order_within_one_clock_tick(self):
+        with mock.patch.object(profiling, '_last_ns', 0), \
+                mock.patch.object(profiling.time, 'time_ns', return_value=1_800_000_000_123_456_789):
+            ids = [profiling.new_profile_id() for _ in range(50)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 50)
+        self.assertTrue(ids[0].startswith('20270115T080000-123456'))
+        self.assertTrue(all(profiling.PROFILE_ID_RE.match(profile_id) for profile_id in ids))
+
+    def test_list_and_download_have_distinct_operation_ids(self):
+        paths = schema.generate_schema()['paths']
+        self.assertEqual(paths['/api/system/profiles/']['get']['operationId'], 'system_profiles_list')
+        self.assertEqual(paths['/api/system/profiles/{profile_id}/']['get']['operationId'], 'system_profiles_retrieve')
+
+    def test_only_staff_with_the_flag_are_profiled(self):
+        self.assertNotIn('X-Profile-Id', self.get('/api/movies/', self.user, HTTP_X_PROFILE='1'))
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/movies/?_profile=1'))
+        self.assertNotIn('X-Profile-Id', self.get('/api/movies/', self.staff))
+        self.assertEqual(self.get('/api/system/profiles/', self.user).status_code, 403)
+
+    def test_unknown_profile_id(self):
+        self.assertEqual(self.get('/api/system/profiles/../../etc/', self.staff).status_code, 404)
+        self.assertEqual(self.get('/api/system/profiles/20260101T000000-deadbeef/', self.staff).status_code, 404)
+        self.assertEqual(
+            self.get('/api/system/profiles/20260101T000000-000000001-deadbeef/', self.staff).status_code, 404
+        )
+
+    def test_listing_skips_runs_pruned_meanwhile(self):
+        ids = [self.get('/api/?_profile=1', self.staff)['X-Profile-Id'] for _ in range(2)]
+        read_text = Path.read_text
+
+        def pruned_meanwhile(path, *args, **kwargs):
+            if path.stem == ids[1]:
+                path.unlink()
+            return read_text(path, *args, **kwargs)
+
+        with mock.patch.object(Path, 'read_text', pruned_meanwhile):
+            response = self.get('/api/system/profiles/', self.staff)
+        self.assertEqual([run['id'] for run in response.json()], [ids[0]])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], TRENDING_HALF_LIFE_HOURS=24)
+class TrendingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.raters = [make_user(f'rater{i}') for i in range(6)]
+        cls.classic = Movie.objects.create(title='Classic', genre=Movie.Genre.DRAMA, release_year=1960, created_by=cls.owner)
+        cls.new = Movie.objects.create(title='New', genre=Movie.Genre.DRAMA, release_year=2026, created_by=cls.owner)
+
+    def scores(self):
+        return dict(MovieTrendingScore.objects.values_list('movie_id', 'log_score'))
+
+    def test_recent_ratings_outrank_older_volume(self):
+        for user in self.raters:
+            Rating.objects.create(movie=self.classic, user=user, rating=5)
+        Rating.objects.filter(movie=self.classic).update(created_at=timezone.now() - timedelta(days=5))
+        for user in self.raters[:2]:
+            Rating.objects.create(movie=self.new, user=user, rating=4)
+        trending.rebuild()
+
+        items = APIClient().get('/api/movies/trending/').json()['items']
+        self.assertEqual([item['title'] for item in items], ['New', 'Classic'])
+        # Six ratings five half-lives old weigh 6 / 32
+        self.assertAlmostEqual(items[1]['trending_score'], 6 / 32, places=3)
+        self.assertAlmostEqual(items[0]['trending_score'], 2, places=3)
+
+    def test_incremental_scores_match_rebuild(self):
+        client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, user in enumerate(self.raters):
+                client.force_authenticate(user)
+                client.post(f'/api/movies/{self.new.id}/ratings/', {'rating': 3}, format='json')
+                if i % 2:
+                    Rating.objects.create(movie=self.classic, user=user, rating=2)
+            client.post(f'/api/movies/{self.new.id}/ratings/', {'rating': 5}, format='json')  # an update, not a new rating
+        incremental = self.scores()
+        trending.rebuild()
+        rebuilt = self.scores()
+        self.assertEqual(set(incremental), set(rebuilt))
+        for movie_id, score in rebuilt.items():
+            self.assertAlmostEqual(incremental[movie_id], score, places=9)
+
+    def test_score_is_written_in_the_rating_transaction(self):
+        client = APIClient()
+        client.force_authenticate(self.raters[0])
+        url = f'/api/movies/{self.new.id}/ratings/'
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post(url, {'rating': 4}, format='json').status_code, 201)
+        statements = [query['sql'] for query in queries]
+        trending_write = next(i for i, sql in enumerate(statements) if 'users_movietrendingscore' in sql)
+        # Nothing runs after the transaction ends
+        self.assertTrue(statements[-1].startswith('RELEASE SAVEPOINT'))
+        self.assertLess(trending_write, len(statements) - 1)
+        self.assertEqual(len(statements), 2 + (3 if connection.vendor == 'postgresql' else 4))
+        self.assertAlmostEqual(trending.current_score(self.scores()[self.new.id]), 1, places=3)
+
+        # A failing score update takes the rating down with it instead of being lost
+        client.force_authenticate(self.raters[1])
+        with mock.patch.object(trending, 'record', side_effect=RuntimeError('score write failed')):
+            with self.assertRaises(RuntimeError):
+                client.post(url, {'rating': 2}, format='json')
+        self.assertFalse(Rating.objects.filter(user=self.raters[1]).exists())
+        self.assertEqual(Movie.objects.get(id=self.new.id).ratings_count, 1)
+
+    @override_settings(OUTBOX_MODE='deferred')
+    def test_deferred_events_are_coalesced(self):
+        for user in self.raters[:3]:
+            Rating.objects.create(movie=self.new, user=user, rating=4)
+        self.assertEqual(self.scores(), {})
+        outbox.process_batch()
+        self.assertAlmostEqual(trending.current_score(self.scores()[self.new.id]), 3, places=3)
+
+    def test_feed_does_not_read_ratings(self):
+        Rating.objects.create(movie=self.new, user=self.raters[0], rating=4)
+        with CaptureQueriesContext(connection) as queries:
+            APIClient().get('/api/movies/trending/')
+        self.assertFalse([q for q in queries if 'users_rating' in q['sql']])
+
+
+@skipUnless(catalog.np is not None, 'numpy is not installed')
+@override_settings(MOVIE_CATALOG={'ENABLED': True, 'REFRESH_INTERVAL': 0, 'OVERLAP': 0})
+class CatalogSnapshotTests(TestCase):
+    QUERIES = [
+        '',
+        'genre=drama',
+        'genre=unknown',
+        'min_rating=2&max_rating=4',
+        'min_ratings_count=3&min_year=1990',
+        'genre=ACTION&max_year=2000&sort=count',
+        'sort=newest&min_rating=1.5',
+        'sort=year&page=2&limit=5',
+        'sort=title',
+        'search=movie 1',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        Movie.objects.bulk_create([
+            Movie(
+                title=f'Movie {i:02}', genre=[Movie.Genre.DRAMA, Movie.Genre.ACTION, Movie.Genre.COMEDY][i % 3], release_year=1980 + i % 30,
+                created_by=cls.owner, ratings_count=i % 7, ratings_avg=(i % 5) + 0.5,
+            )
+            for i in range(60)
+        ])
+
+    def setUp(self):
+        catalog.movie_catalog.invalidate()
+        self.addCleanup(catalog.movie_catalog.invalidate)
+
+    def list_movies(self, query):
+        response = APIClient().get('/api/movies/?limit=50&' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_matches_sql_results(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                from_snapshot = self.list_movies(query)
+                with override_settings(MOVIE_CATALOG={'ENABLED': False}):
+                    from_sql = self.list_movies(query)
+                self.assertEqual(from_snapshot, from_sql)
+
+    def test_page_is_loaded_by_primary_key(self):
+        self.list_movies('')  # build the snapshot
+        with CaptureQueriesContext(connection) as queries:
+            self.list_movies('genre=drama&sort=count')
+        self.assertEqual(len(queries), 1 + 2)  # the page, plus the incremental refresh
+        self.assertIn('"users_movie"."id" IN', queries[-1]['sql'])
+
+    def test_incremental_refresh(self):
+        self.list_movies('')
+        movies = list(Movie.objects.order_by('id')[:3])
+        # Rating changes move updated_at
+        Movie.objects.filter(id=movies[0].id).apply_rating_delta({5: 100})
+        Movie.objects.filter(id=movies[1].id).update(pending_deletion=True, updated_at=timezone.now())
+        added = Movie.objects.create(title='Fresh', genre=Movie.Genre.DRAMA, release_year=2026, created_by=self.owner)
+
+        by_count = self.list_movies('sort=count')
+        self.assertEqual(by_count['items'][0]['title'], movies[0].title)
+        self.assertEqual(by_count['total'], 60)
+        newest = [item['title'] for item in self.list_movies('sort=newest&min_ratings_count=0')['items']]
+        self.assertEqual(newest[0], added.title)
+        self.assertNotIn(movies[1].title, newest)
+        with override_settings(MOVIE_CATALOG={'ENABLED': False}):
+            self.assertEqual(self.list_movies('sort=count'), by_count)
+
+
+
+@skipUnless(catalog.np is not None, 'numpy is not installed')
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    MOVIE_CATALOG={'ENABLED': True, 'REFRESH_INTERVAL': 3600, 'FULL_REFRESH_INTERVAL': 3600},
+)
+class CatalogRebuildTests(TransactionTestCase):
+    def setUp(self):
+        self.catalog = catalog.MovieCatalog()
+        owner = make_user('owner')
+        self.movies = [
+            Movie.objects.create(title=f'Movie {i}', genre=Movie.Genre.DRAMA, release_year=2000, created_by=owner)
+            for i in range(3)
+        ]
+
+    def ids(self):
+        return [int(movie_id) for movie_id in self.catalog.select(Movie.objects.all(), 'newest').ids]
+
+    def test_reads_continue_during_a_full_rebuild(self):
+        self.assertEqual(len(self.ids()), 3)
+        Movie.objects.filter(id=self.movies[0].id).delete()  # Only a full rebuild drops it
+
+        building, release = threading.Event(), threading.Event()
+        build = self.catalog._build
+
+        def slow_build():
+            building.set()
+            release.wait(5)
+            return build()
+
+        with mock.patch.object(self.catalog, '_build', slow_build):
+            self.catalog._rebuilt_at = 0.0  # Due now
+            started = time.monotonic()
+            self.assertEqual(len(self.ids()), 3)  # Starts the rebuild, answers from the old snapshot
+            self.assertTrue(building.wait(5))
+            self.assertEqual(len(self.ids()), 3)
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertIsNone(self.catalog.start_rebuild())  # One rebuild at a time
+            release.set()
+            deadline = time.monotonic() + 5
+            while self.catalog._rebuilding and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(self.ids(), [self.movies[2].id, self.movies[1].id])
+
+    def test_writes_made_during_a_rebuild_are_kept(self):
+        self.ids()
+        building, release = threading.Event(), threading.Event()
+        build = self.catalog._build
+
+        def slow_build():
+            built = build()  # Has read the table before the write below
+            building.set()
+            release.wait(5)
+            return built
+
+        with mock.patch.object(self.catalog, '_build', slow_build), \
+                override_settings(MOVIE_CATALOG={'REFRESH_INTERVAL': 0}):
+            self.catalog._rebuilt_at = 0.0  # Due now
+            self.ids()
+            self.assertTrue(building.wait(5))
+            late = Movie.objects.create(
+                title='Late', genre=Movie.Genre.DRAMA, release_year=2000, created_by=self.movies[0].created_by,
+            )
+            self.assertEqual(self.ids()[0], late.id)  # Still caught up while the rebuild runs
+            release.set()
+            deadline = time.monotonic() + 5
+            while self.catalog._rebuilding and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertGreater(self.catalog._rebuilt_at, 0.0)
+        with override_settings(MOVIE_CATALOG={'REFRESH_INTERVAL': 3600}):
+            self.assertEqual(self.ids()[0], late.id)  # The rebuilt snapshot replayed it before the swap
+
+    def test_invalidate_discards_a_rebuild_in_flight(self):
+        self.ids()
+        release = threading.Event()
+        build = self.catalog._build
+        with mock.patch.object(self.catalog, '_build', lambda: release.wait(5) and build()):
+            thread = self.catalog.start_rebuild()
+            self.catalog.invalidate()
+            release.set()
+            thread.join(5)
+        self.assertIsNone(self.catalog._snapshot)
+        self.assertEqual(len(self.ids()), 3)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CompactStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+
+    def test_genre_label_round_trips_through_the_api(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.post('/api/movies/add/', {'title': 'Arrival', 'genre': 'Sci-Fi', 'release_year': 2016})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['genre'], 'Sci-Fi')
+        self.assertEqual(Movie.objects.get(title='Arrival').genre, Movie.Genre.SCI_FI)
+        self.assertEqual(APIClient().get('/api/movies/?genre=sci-fi').json()['items'][0]['title'], 'Arrival')
+
+        response = client.post('/api/movies/add/', {'title': 'Other', 'genre': 'Western', 'release_year': 2016})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('genre', response.json())
+
+    @skipUnless(connection.vendor == 'sqlite', 'checks the SQLite dbstat path')
+    def test_storage_report_lists_tables_and_indexes(self):
+        Movie.objects.create(title='Sized', genre=Movie.Genre.DRAMA, release_year=2000, created_by=self.owner)
+        out = StringIO()
+        call_command('storage_report', stdout=out)
+        report = out.getvalue()
+        self.assertIn('users_movie: 1 rows', report)
+        self.assertIn('movie_rating_sort_idx', report)
+        self.assertIn('users_rating: 0 rows', report)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'declarative partitioning is PostgreSQL only')
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RatingPartitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.raters = [make_user(f'rater{i}') for i in range(3)]
+        cls.movies = [
+            Movie.objects.create(title=f'Movie {i}', genre=Movie.Genre.DRAMA, release_year=2000 + i, created_by=cls.owner)
+            for i in range(4)
+        ]
+        Rating.objects.create(movie=cls.movies[0], user=cls.raters[0], rating=3)
+
+    def test_only_the_command_applies_the_setting(self):
+        migration = importlib.import_module('users.migrations.0014_rating_partitions').Migration('0014', 'users')
+        with override_settings(RATING_PARTITIONS=2), connection.cursor() as cursor:
+            with connection.schema_editor(atomic=False) as editor:
+                migration.apply(ProjectState(), editor)
+            self.assertEqual(partitioning.partition_count(cursor, 'users_rating'), 0)
+
+            out = StringIO()
+            call_command('partition_ratings', stdout=out)
+            self.assertEqual(partitioning.partition_count(cursor, 'users_rating'), 2)
+            self.assertIn('rebuilt as 2 hash partition(s)', out.getvalue())
+        self.assertEqual(Rating.objects.get().rating, 3)
+
+    def test_rating_paths_work_on_a_partitioned_table(self):
+        with connection.cursor() as cursor:
+            self.assertTrue(partitioning.repartition(cursor, 'users_rating', 4))
+            self.assertEqual(partitioning.partition_count(cursor, 'users_rating'), 4)
+        self.assertEqual(Rating.objects.get().rating, 3)
+
+        client = APIClient()
+        client.force_authenticate(self.raters[1])
+        for movie in self.movies:
+            self.assertEqual(client.post(f'/api/movies/{movie.id}/ratings/', {'rating': 4}).status_code, 201)
+        self.assertEqual(client.post(f'/api/movies/{self.movies[0].id}/ratings/', {'rating': 2}).status_code, 200)
+
+        ratings = client.get(f'/api/movies/{self.movies[0].id}/ratings/').json()['items']
+        self.assertEqual(sorted(item['rating'] for item in ratings), [2, 3])
+        self.assertEqual(Movie.objects.get(id=self.movies[0].id).ratings_count, 2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rating.objects.bulk_create([Rating(movie=self.movies[1], user=self.raters[1], rating=1)])
+
+        # New ids continue the old sequence
+        latest = Rating.objects.create(movie=self.movies[2], user=self.raters[2], rating=5)
+        self.assertGreater(latest.id, max(Rating.objects.exclude(id=latest.id).values_list('id', flat=True)))
@@ -0,0 +1,100 @@
+"""
+Time-decayed trending scores.
+
+A movie's trending score is the sum over its ratings of
+``exp(-DECAY * (now - rated_at))``, i.e. rating velocity with a half-life of
+TRENDING_HALF_LIFE_HOURS. Multiplying every score by ``exp(DECAY * (now - EPOCH))``
+does not change the ranking, so ``MovieTrendingScore.log_score`` stores
+``log(sum(exp(DECAY * (rated_at - EPOCH))))``, which never has to be decayed:
+a new rating is folded in with one log-add-exp UPDATE, and the trending feed
+is an index scan on log_score. ``current_score()`` converts back to the
+decayed value for display.
+
+Scores are fed by the ``rating.created`` outbox event;
+``manage.py rebuild_trending_scores`` recomputes them from Rating.created_at.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+# Ratings older than this many half-lives weigh under 1e-6 and are skipped on rebuild
+REBUILD_HALF_LIVES = 20
+
+
+def half_life():
+    return timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24))
+
+
+def decay_rate():
+    return math.log(2) / half_life().total_seconds()
+
+
+def log_weight(at):
+    """log of the undecayed weight of a rating made at ``at`` (datetime or epoch seconds)"""
+    if isinstance(at, datetime):
+        at = at.timestamp()
+    return decay_rate() * (at - EPOCH.timestamp())
+
+
+def log_add_exp(a, b):
+    """log(exp(a) + exp(b)) without overflow"""
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def log_sum_exp(values):
+    peak = max(values)
+    return peak + math.log(sum(math.exp(value - peak) for value in values))
+
+
+def current_score(log_score, now=None):
+    """Decayed score as of ``now``: sum of exp(-DECAY * age) over the movie's ratings"""
+    return math.exp(log_score - log_weight(now or timezone.now()))
+
+
+def record(times_by_movie):
+    """Fold ratings made at the given times into the scores; ``{movie_id: [time, ...]}``"""
+    from .models import MovieTrendingScore
+
+    table = MovieTrendingScore._meta.db_table
+    movie_table = MovieTrendingScore._meta.get_field('movie').related_model._meta.db_table
+    # log(exp(a) + exp(b)) without overflow; the SELECT skips movies deleted meanwhile
+    sql = f"""
+        INSERT INTO {table} (movie_id, log_score)
+        SELECT id, %s FROM {movie_table} WHERE id = %s
+        ON CONFLICT (movie_id) DO UPDATE SET log_score = CASE
+            WHEN {table}.log_score > EXCLUDED.log_score
+            THEN {table}.log_score + LN(1 + EXP(EXCLUDED.log_score - {table}.log_score))
+            ELSE EXCLUDED.log_score + LN(1 + EXP({table}.log_score - EXCLUDED.log_score))
+        END
+    """
+    with connection.cursor() as cursor:
+        for movie_id, times in times_by_movie.items():
+            cursor.execute(sql, [log_sum_exp([log_weight(at) for at in times]), movie_id])
+
+
+def rebuild(batch_size=1000):
+    """Recompute every score from Rating.created_at; returns the number of movies scored"""
+    from .models import MovieTrendingScore, Rating
+
+    since = timezone.now() - half_life() * REBUILD_HALF_LIVES
+    scores = {}
+    rows = Rating.objects.filter(created_at__gte=since).values_list('movie_id', 'created_at').order_by()
+    for movie_id, created_at in rows.iterator(chunk_size=10000):
+        weight = log_weight(created_at)
+        scores[movie_id] = log_add_exp(scores[movie_id], weight) if movie_id in scores else weight
+
+    with transaction.atomic():
+        MovieTrendingScore.objects.all().delete()
+        MovieTrendingScore.objects.bulk_create(
+            [MovieTrendingScore(movie_id=movie_id, log_score=score) for movie_id, score in scores.items()],
+            batch_size=batch_size,
+        )
+    return len(scores)
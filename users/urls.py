@@ -1,5 +1,6 @@
 from django.urls import path
 from . import views
+from .utils import method_dispatch
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -7,6 +8,9 @@ from rest_framework_simplejwt.views import (
 
 urlpatterns = [
     path('', views.health_check, name="health"),
+    path('system/movie-cache/', views.movie_cache_stats, name="movie_cache_stats"),
+    path('system/profiles/', views.list_profiles, name="list_profiles"),
+    path('system/profiles/<str:profile_id>/', views.get_profile, name="get_profile"),
     path('auth/register/', views.register_user, name="register"),
     path('auth/login/', views.login_user, name="login"),
     path('auth/logout/', views.logout_user, name="logout"),
@@ -18,12 +22,21 @@ urlpatterns = [
     # Movies endpoints
     path('movies/add/', views.create_movie, name='create_movie'),  # POST - create movie
     path('movies/', views.list_movies, name='list_movies'),  # GET - list movies
-    path('movies/<int:movie_id>/', views.get_movie_detail, name='movie_detail'),  # GET - movie details
-    path('movies/<int:movie_id>/', views.delete_movie, name='delete_movie'),  # DELETE - delete movie
+    path('movies/autocomplete/', views.autocomplete_movies, name='autocomplete_movies'),  # GET - title typeahead
+    path('movies/trending/', views.trending_movies, name='trending_movies'),  # GET - trending feed
+    path(
+        'movies/<int:movie_id>/',
+        method_dispatch(get=views.get_movie_detail, delete=views.delete_movie),  # GET - movie details, DELETE - delete movie
+        name='movie_detail',
+    ),
+    path('movies/deletions/<int:deletion_id>/', views.get_movie_deletion, name='movie_deletion'),  # GET - deletion progress
     
     # Rating endpoints
-    path('movies/<int:movie_id>/ratings/', views.rate_movie, name='rate_movie'),  # POST - rate movie
-    path('movies/<int:movie_id>/ratings/', views.get_movie_ratings, name='get_movie_ratings'),  # GET - movie ratings    
+    path(
+        'movies/<int:movie_id>/ratings/',
+        method_dispatch(post=views.rate_movie, get=views.get_movie_ratings),  # POST - rate movie, GET - movie ratings
+        name='movie_ratings',
+    ),
     path('user/ratings/', views.get_user_ratings, name='user_ratings'),  # GET - current user's ratings
     # path('users/<int:user_id>/ratings/', views.get_user_ratings_by_id, name='user_ratings_by_id'),  # GET - specific user's ratings]
 ]
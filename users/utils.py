@@ -1,4 +1,6 @@
+from django.http import HttpResponseNotAllowed
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 def set_auth_cookies(response: Response, access_token: str, refresh_token: str) -> Response:
     # Access token
@@ -26,3 +28,25 @@ def clear_auth_cookies(response: Response) -> Response:
     response.delete_cookie("access")
     response.delete_cookie("refresh")
     return response
+
+
+def method_dispatch(**views):
+    """
+    Serve one URL with several @api_view functions, chosen by HTTP method,
+    e.g. ``method_dispatch(get=get_movie_detail, delete=delete_movie)``.
+    Each view keeps its own permissions and schema annotations.
+    """
+    def dispatch(request, *args, **kwargs):
+        method = request.method.lower()
+        view = views.get('get' if method == 'head' else method)
+        if view is None:
+            return HttpResponseNotAllowed([name.upper() for name in views])
+        return view(request, *args, **kwargs)
+
+    # Schema generation introspects ``cls`` like a single APIView with all the methods
+    dispatch.cls = type('MethodDispatchView', (APIView,), {
+        method: getattr(view.cls, method) for method, view in views.items()
+    })
+    dispatch.initkwargs = {}
+    dispatch.csrf_exempt = True
+    return dispatch
@@ -1,26 +1,112 @@
+import hashlib
+from urllib.parse import urlencode
+
 from django.shortcuts import render
+from django.http import FileResponse, HttpResponse
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.exceptions import TokenError
 from django.contrib.auth import get_user_model
 from django.conf import settings
 
-from .serializers import UserRegistrationSerializer, UserLoginSerializer, MovieSerializer, RatingSerializer, MovieDetailSerializer, UserDataSerializer
+from .serializers import UserRegistrationSerializer, UserLoginSerializer, MovieSerializer, RatingSerializer, RatingUpsertSerializer, MovieDetailSerializer, MovieDeletionSerializer, TrendingMovieSerializer, UserDataSerializer
 # from .utils.cookies import set_auth_cookies, clear_auth_cookies
 from .utils import set_auth_cookies, clear_auth_cookies
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
-from .models import Movie, Rating
+from .models import Movie, MovieDeletion, Rating
+from .deletion import request_movie_deletion
+from . import profiling
+from .cache import movie_cache
+from .singleflight import read_flight
+from .catalog import movie_catalog
+from .blacklist import BlacklistedRefreshToken
 
 
 User = get_user_model()
 
+FIELDSET_PARAMETERS = [
+    OpenApiParameter(name='fields', description='Comma-separated fields to include', type=str),
+    OpenApiParameter(name='exclude', description='Comma-separated fields to leave out', type=str),
+]
+
+MY_RATING_PARAMETER = OpenApiParameter(
+    name='include', description="'my_rating' adds the authenticated caller's rating (or null)", type=str,
+    enum=['my_rating'],
+)
+
+
+def my_rating_context(request, movies, fieldset):
+    """
+    Serializer context entry for ``?include=my_rating``: the caller's rating of
+    each of ``movies``, fetched in one query (none for anonymous callers).
+    Empty dict when my_rating wasn't asked for.
+    """
+    include = [name for name in request.GET.get('include', '').split(',') if name]
+    if set(include) - {'my_rating'}:
+        raise ValidationError({'include': "Must be: my_rating"})
+    if not include or (fieldset is not None and 'my_rating' not in fieldset):
+        return {}
+    if not request.user.is_authenticated:
+        return {'my_ratings': {}}
+    ratings = Rating.objects.filter(user=request.user, movie_id__in=[movie.pk for movie in movies])
+    return {'my_ratings': dict(ratings.values_list('movie_id', 'rating'))}
+
+
+def read_key(request):
+    """Single-flight key for a read: the path and query string, minus per-caller options"""
+    params = sorted(
+        (name, value) for name, values in request.GET.lists() if name not in ('include', '_profile')
+        for value in values
+    )
+    return 'read:' + hashlib.sha1(f'{request.path}?{urlencode(params)}'.encode()).hexdigest()
+
+
+def read_page(request, movies, page, limit):
+    """
+    Page ``page`` of ``movies`` as ``(movies, pagination fields)``. Identical
+    concurrent requests share one count and page query; with
+    ``SINGLE_FLIGHT["TTL"]`` the page is also cached (users/singleflight.py).
+    """
+    def load():
+        paginator = Paginator(movies, limit)
+        try:
+            movies_page = paginator.page(page)
+        except PageNotAnInteger:
+            movies_page = paginator.page(1)
+        except EmptyPage:
+            movies_page = paginator.page(paginator.num_pages)
+        return list(movies_page), {
+            "page": movies_page.number,
+            "limit": limit,
+            "total": paginator.count,
+            "total_pages": paginator.num_pages,
+            "has_next": movies_page.has_next(),
+            "has_previous": movies_page.has_previous(),
+        }
+
+    return read_flight.cached(read_key(request), load)
+
+
+# Allowed list_movies ?sort= values. Each ordering matches an index on Movie
+# (read backwards for descending), so the page comes off the index without a sort step.
+MOVIE_SORT_ORDERS = {
+    'rating': ('-ratings_avg', '-created_at', '-id'),
+    'count': ('-ratings_count', '-id'),
+    'newest': ('-created_at', '-id'),
+    'year': ('-release_year', '-id'),
+    'title': ('title', 'release_year'),
+}
+
 
 @extend_schema(
         tags=["System"],
@@ -55,7 +141,7 @@ def register_user(request):
         user_data = UserDataSerializer(user).data
         
         # Generate tokens
-        refresh = RefreshToken.for_user(user)
+        refresh = BlacklistedRefreshToken.for_user(user)
         access_token = str(refresh.access_token)
         refresh_token = str(refresh)
         
@@ -96,7 +182,7 @@ def login_user(request):
         print("AUTH USER:", user)
 
         # Generate tokens
-        refresh = RefreshToken.for_user(user)
+        refresh = BlacklistedRefreshToken.for_user(user)
         access_token = str(refresh.access_token)
         refresh_token = str(refresh)
 
@@ -135,6 +221,14 @@ def login_user(request):
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def logout_user(request):
+    refresh_token = request.data.get("refresh") or request.COOKIES.get("refresh")
+    if refresh_token:
+        try:
+            # Written to the database before responding, so no other worker accepts it afterwards
+            BlacklistedRefreshToken(refresh_token).blacklist()
+        except TokenError:
+            # Already expired, invalid or blacklisted: nothing left to revoke
+            pass
     response = Response({"message": "Logged out successfully"}, status=status.HTTP_200_OK)
     return clear_auth_cookies(response)
 
@@ -166,7 +260,7 @@ def create_movie(request):
     tags=["Movies"],
     summary="Rate a movie",
     description="Rate or update rating for a specific movie (protected - requires authentication)",
-    request=RatingSerializer,
+    request=RatingUpsertSerializer,
     responses={
         201: RatingSerializer,
         200: RatingSerializer,
@@ -177,42 +271,37 @@ def create_movie(request):
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def rate_movie(request, movie_id):
+    serializer = RatingUpsertSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # Single upsert keyed on (movie, user); repeated submits update instead of conflicting
     try:
-        movie = Movie.objects.get(id=movie_id)
-    except Movie.DoesNotExist:
+        with transaction.atomic():
+            rating, movie, created = Rating.objects.upsert(
+                movie_id,
+                request.user,
+                serializer.validated_data['rating'],
+                review=serializer.validated_data.get('review'),
+                set_review='review' in serializer.validated_data,
+            )
+    except (Movie.DoesNotExist, IntegrityError):
         return Response(
             {"error": "Movie not found"}, 
             status=status.HTTP_404_NOT_FOUND
         )
-    
-    # Check if user already rated this movie
-    try:
-        rating = Rating.objects.get(movie=movie, user=request.user)
-        # Update existing rating
-        serializer = RatingSerializer(rating, data=request.data, partial=True)
-        status_code = status.HTTP_200_OK
-    except Rating.DoesNotExist:
-        # Create new rating
-        serializer = RatingSerializer(data=request.data)
-        status_code = status.HTTP_201_CREATED
-    
-    if serializer.is_valid():
-        # Ensure the rating belongs to the current user and movie
-        serializer.save(movie=movie, user=request.user)
-        
-        # Return rating along with updated movie stats
-        response_data = {
-            "rating": serializer.data,
-            "movie": {
-                "id": movie.id,
-                "title": movie.title,
-                "ratings_count": movie.ratings_count,
-                "ratings_avg": round(movie.ratings_avg, 2)
-            }
+
+    # Return rating along with updated movie stats
+    response_data = {
+        "rating": RatingSerializer(rating).data,
+        "movie": {
+            "id": movie.id,
+            "title": movie.title,
+            "ratings_count": movie.ratings_count,
+            "ratings_avg": round(movie.ratings_avg, 2)
         }
-        return Response(response_data, status=status_code)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    }
+    return Response(response_data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
 # Get all movies 
@@ -226,6 +315,13 @@ def rate_movie(request, movie_id):
         OpenApiParameter(name='genre', description='Filter by genre', type=str),
         OpenApiParameter(name='search', description='Search in title and description', type=str),
         OpenApiParameter(name='min_rating', description='Minimum average rating', type=float),
+        OpenApiParameter(name='max_rating', description='Maximum average rating', type=float),
+        OpenApiParameter(name='min_ratings_count', description='Minimum number of ratings', type=int),
+        OpenApiParameter(name='min_year', description='Earliest release year', type=int),
+        OpenApiParameter(name='max_year', description='Latest release year', type=int),
+        OpenApiParameter(name='sort', description='Sort order (default rating)', type=str, enum=list(MOVIE_SORT_ORDERS)),
+        *FIELDSET_PARAMETERS,
+        MY_RATING_PARAMETER,
     ],
     responses={200: MovieSerializer(many=True)},
 )
@@ -238,29 +334,55 @@ def list_movies(request):
     genre = request.GET.get('genre', '')
     search = request.GET.get('search', '')
     min_rating = request.GET.get('min_rating', '')
+    sort = request.GET.get('sort') or 'rating'
+    fieldset = MovieSerializer.get_fieldset(request.GET)
+    if sort not in MOVIE_SORT_ORDERS:
+        raise ValidationError({'sort': f"Must be one of: {', '.join(MOVIE_SORT_ORDERS)}"})
     
-    # Base queryset
-    movies = Movie.objects.select_related('created_by').prefetch_related('ratings')
-    
-    # Apply filters
-    if genre:
-        movies = movies.filter(genre__iexact=genre)
-    
-    if search:
-        movies = movies.filter(
-            Q(title__icontains=search) | 
-            Q(description__icontains=search)
-        )
-    
-    if min_rating:
-        try:
-            min_rating_float = float(min_rating)
-            movies = movies.filter(ratings_avg__gte=min_rating_float)
-        except ValueError:
-            pass
-    
-    # Order by highest rated first, then newest
-    movies = movies.order_by('-ratings_avg', '-created_at')
+    # Base queryset, loading only the columns and joins the requested fields need
+    movies = MovieSerializer.narrow_queryset(Movie.objects.visible(), fieldset)
+
+    # Range filters; malformed values are ignored
+    ranges = []
+    params = [
+        (min_rating, float, 'ratings_avg', 'gte'),
+        (request.GET.get('max_rating', ''), float, 'ratings_avg', 'lte'),
+        (request.GET.get('min_ratings_count', ''), int, 'ratings_count', 'gte'),
+        (request.GET.get('min_year', ''), int, 'release_year', 'gte'),
+        (request.GET.get('max_year', ''), int, 'release_year', 'lte'),
+    ]
+    for value, parse, field, lookup in params:
+        if value:
+            try:
+                ranges.append((field, lookup, parse(value)))
+            except ValueError:
+                pass
+
+    if movie_catalog.supports(sort, search):
+        # Filter and sort in this worker's columnar snapshot; only the page is loaded
+        movies = movie_catalog.select(movies, sort, genre=genre, ranges=ranges)
+    else:
+        # Apply filters
+        if genre:
+            # Unknown genres match nothing, as the case-insensitive label match used to
+            movies = movies.filter(genre=Movie.Genre.from_label(genre) or 0)
+
+        if search:
+            movies = movies.filter(
+                Q(title__icontains=search) |
+                Q(description__icontains=search)
+            )
+
+        order = MOVIE_SORT_ORDERS[sort]
+        for field, lookup, value in ranges:
+            if field != order[0].lstrip('-'):
+                # Checked row by row while walking the sort index. If the planner used
+                # this column's own index instead, every matching row would need sorting.
+                movies = movies.alias(**{f'{field}_unindexed': F(field) + 0})
+                field = f'{field}_unindexed'
+            movies = movies.filter(**{f'{field}__{lookup}': value})
+
+        movies = movies.order_by(*order)
     
     # Pagination
     try:
@@ -268,42 +390,103 @@ def list_movies(request):
     except ValueError:
         limit = 10
     
-    paginator = Paginator(movies, limit)
-    
-    try:
-        movies_page = paginator.page(page)
-    except PageNotAnInteger:
-        movies_page = paginator.page(1)
-    except EmptyPage:
-        movies_page = paginator.page(paginator.num_pages)
+    movies_page, pagination = read_page(request, movies, page, limit)
     
     # Serialize data
-    serializer = MovieSerializer(movies_page, many=True)
+    context = {'fieldset': fieldset, **my_rating_context(request, movies_page, fieldset)}
+    serializer = MovieSerializer(movies_page, many=True, context=context)
     
     # Return paginated response
-    return Response({
-        "items": serializer.data,
-        "page": movies_page.number,
-        "limit": limit,
-        "total": paginator.count,
-        "total_pages": paginator.num_pages,
-        "has_next": movies_page.has_next(),
-        "has_previous": movies_page.has_previous(),
-    })
+    return Response({"items": serializer.data, **pagination})
+
+
+@extend_schema(
+    tags=["Movies"],
+    summary="Trending movies",
+    description="Movies ranked by time-decayed rating velocity (recent ratings count most)",
+    parameters=[
+        OpenApiParameter(name='page', description='Page number', type=int),
+        OpenApiParameter(name='limit', description='Items per page', type=int),
+    ],
+    responses={200: TrendingMovieSerializer(many=True)},
+)
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def trending_movies(request):
+    page = request.GET.get('page', 1)
+    limit = request.GET.get('limit', 10)
+
+    # Stored scores are already in rank order; this is an index scan, no aggregation.
+    # Of the creator only the username is loaded, so cached pages hold no user rows.
+    movies = (
+        Movie.objects.visible()
+        .filter(trending__isnull=False)
+        .select_related('trending', 'created_by')
+        .only(*[field.name for field in Movie._meta.concrete_fields], 'trending__log_score', 'created_by__username')
+        .order_by('-trending__log_score', '-trending__movie_id')
+    )
+
+    try:
+        limit = min(int(limit), 50)  # Cap at 50 items per page
+    except ValueError:
+        limit = 10
+
+    movies_page, pagination = read_page(request, movies, page, limit)
+    serializer = TrendingMovieSerializer(movies_page, many=True)
+    return Response({"items": serializer.data, **pagination})
+
+
+@extend_schema(
+    tags=["Movies"],
+    summary="Autocomplete movie titles",
+    description="Top matches whose title starts with `q` (case-insensitive), for search-as-you-type",
+    parameters=[
+        OpenApiParameter(name='q', description='Title prefix', type=str, required=True),
+        OpenApiParameter(name='limit', description='Maximum matches (default 10, max 20)', type=int),
+    ],
+    responses={200: {"description": "List of {id, title, release_year}"}},
+)
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def autocomplete_movies(request):
+    prefix = request.GET.get('q', '').strip()
+    try:
+        limit = max(min(int(request.GET.get('limit', 10)), 20), 1)
+    except ValueError:
+        limit = 10
+
+    items = []
+    if prefix:
+        # Index range scan on UPPER(title); only the three columns are read
+        matches = Movie.objects.visible().title_prefix(prefix).values_list('id', 'title', 'release_year')[:limit]
+        items = [{"id": id, "title": title, "release_year": year} for id, title, year in matches]
+    response = Response(items)
+    response['Cache-Control'] = 'public, max-age=30'
+    return response
 
 
 @extend_schema(
     tags=["Movies"],
     summary="Get movie details",
     description="Get detailed information about a specific movie",
+    parameters=[*FIELDSET_PARAMETERS, MY_RATING_PARAMETER],
     responses={200: MovieDetailSerializer, 404: {"description": "Movie not found"}},
 )
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def get_movie_detail(request, movie_id):
+    fieldset = MovieDetailSerializer.get_fieldset(request.GET)
+
+    def load():
+        movie = movie_cache.get(movie_id)
+        if fieldset is None or 'recent_ratings' in fieldset:
+            movie.recent_ratings = list(MovieDetailSerializer.recent_ratings_queryset(movie))
+        return movie
+
     try:
-        movie = Movie.objects.get(id=movie_id)
-        serializer = MovieDetailSerializer(movie)
+        movie = read_flight.cached(read_key(request), load)
+        context = {'fieldset': fieldset, **my_rating_context(request, [movie], fieldset)}
+        serializer = MovieDetailSerializer(movie, context=context)
         return Response(serializer.data)
     except Movie.DoesNotExist:
         return Response(
@@ -316,21 +499,29 @@ def get_movie_detail(request, movie_id):
     tags=["Ratings"],
     summary="Get user's ratings",
     description="Get all ratings by the authenticated user",
+    parameters=FIELDSET_PARAMETERS,
     responses={200: RatingSerializer(many=True)},
 )
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_user_ratings(request):
-    ratings = Rating.objects.filter(user=request.user).select_related('movie')
-    serializer = RatingSerializer(ratings, many=True)
+    fieldset = RatingSerializer.get_fieldset(request.GET)
+    ratings = RatingSerializer.narrow_queryset(
+        Rating.objects.filter(user=request.user, movie__pending_deletion=False), fieldset
+    )
+    serializer = RatingSerializer(ratings, many=True, context={'fieldset': fieldset})
     return Response(serializer.data)
 
 @extend_schema(
     tags=["Movies"],
     summary="Delete a movie",
-    description="Delete a movie (protected - only the user who created it can delete)",
+    description=(
+        "Delete a movie (protected - only the user who created it can delete). "
+        "The movie is hidden immediately and its ratings are removed in the background; "
+        "poll the returned deletion for progress."
+    ),
     responses={
-        204: {"description": "Movie deleted successfully"},
+        202: MovieDeletionSerializer,
         403: {"description": "Permission denied"},
         404: {"description": "Movie not found"},
     },
@@ -339,7 +530,7 @@ def get_user_ratings(request):
 @permission_classes([IsAuthenticated])
 def delete_movie(request, movie_id):
     try:
-        movie = Movie.objects.get(id=movie_id)
+        movie = movie_cache.get(movie_id)
     except Movie.DoesNotExist:
         return Response(
             {"error": "Movie not found"}, 
@@ -353,8 +544,31 @@ def delete_movie(request, movie_id):
             status=status.HTTP_403_FORBIDDEN
         )
     
-    movie.delete()
-    return Response(status=status.HTTP_204_NO_CONTENT)
+    # Hide now, remove the ratings in bounded chunks out of band
+    deletion = request_movie_deletion(movie, request.user)
+    return Response(MovieDeletionSerializer(deletion).data, status=status.HTTP_202_ACCEPTED)
+
+
+@extend_schema(
+    tags=["Movies"],
+    summary="Get movie deletion status",
+    description="Progress of a background movie deletion (requester or staff only)",
+    responses={200: MovieDeletionSerializer, 404: {"description": "Deletion not found"}},
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_movie_deletion(request, deletion_id):
+    deletions = MovieDeletion.objects.all()
+    if not request.user.is_staff:
+        deletions = deletions.filter(requested_by=request.user)
+    try:
+        deletion = deletions.get(id=deletion_id)
+    except MovieDeletion.DoesNotExist:
+        return Response(
+            {"error": "Deletion not found"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(MovieDeletionSerializer(deletion).data)
 
 @extend_schema(
     tags=["Ratings"],
@@ -363,6 +577,7 @@ def delete_movie(request, movie_id):
     parameters=[
         OpenApiParameter(name='page', description='Page number', type=int),
         OpenApiParameter(name='limit', description='Items per page', type=int),
+        *FIELDSET_PARAMETERS,
     ],
     responses={200: RatingSerializer(many=True)},
 )
@@ -370,7 +585,7 @@ def delete_movie(request, movie_id):
 @permission_classes([AllowAny])
 def get_movie_ratings(request, movie_id):
     try:
-        movie = Movie.objects.get(id=movie_id)
+        movie = movie_cache.get(movie_id)
     except Movie.DoesNotExist:
         return Response(
             {"error": "Movie not found"}, 
@@ -380,9 +595,10 @@ def get_movie_ratings(request, movie_id):
     # Get query parameters
     page = request.GET.get('page', 1)
     limit = request.GET.get('limit', 10)
+    fieldset = RatingSerializer.get_fieldset(request.GET)
     
     # Get ratings for this movie
-    ratings = Rating.objects.filter(movie=movie).select_related('user').order_by('-created_at')
+    ratings = RatingSerializer.narrow_queryset(Rating.objects.filter(movie=movie), fieldset).order_by('-created_at')
     
     # Pagination
     try:
@@ -400,7 +616,7 @@ def get_movie_ratings(request, movie_id):
         ratings_page = paginator.page(paginator.num_pages)
     
     # Serialize data
-    serializer = RatingSerializer(ratings_page, many=True)
+    serializer = RatingSerializer(ratings_page, many=True, context={'fieldset': fieldset})
     
     # Return paginated response
     return Response({
@@ -420,6 +636,63 @@ def get_movie_ratings(request, movie_id):
     })
 
 
+@extend_schema(
+    tags=["System"],
+    summary="Movie cache statistics",
+    description="Hit/miss/eviction counters of this worker's movie cache and single-flight reads (staff only)",
+    responses={200: dict},
+)
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def movie_cache_stats(request):
+    return Response({**movie_cache.stats(), 'single_flight': read_flight.stats()})
+
+
+@extend_schema(
+    tags=["System"],
+    summary="List request profiles",
+    operation_id="system_profiles_list",
+    description="Newest stored profiling runs on this host (staff only). Profile a request with `X-Profile: 1` or `?_profile=1`.",
+    responses={200: dict},
+)
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def list_profiles(request):
+    return Response(profiling.list_profiles())
+
+
+@extend_schema(
+    tags=["System"],
+    summary="Download a request profile",
+    operation_id="system_profiles_retrieve",
+    description="The stored pstats file, or its top functions as text with `?report=1` (staff only)",
+    parameters=[
+        OpenApiParameter(name='report', description='1 for a pstats text report instead of the .prof file', type=int),
+        OpenApiParameter(name='sort', description='pstats sort key for the text report (default cumulative)', type=str),
+    ],
+    responses={200: OpenApiTypes.BINARY, 404: {"description": "Profile not found"}},
+)
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def get_profile(request, profile_id):
+    try:
+        if request.GET.get('report') == '1':
+            report = profiling.render_text(profile_id, sort=request.GET.get('sort', 'cumulative'))
+            return HttpResponse(report, content_type='text/plain; charset=utf-8')
+        path = profiling.profile_path(profile_id)
+    except FileNotFoundError:
+        return Response(
+            {"error": "Profile not found"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except KeyError:
+        return Response(
+            {"error": "Unknown sort key"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return FileResponse(path.open('rb'), as_attachment=True, filename=path.name, content_type='application/octet-stream')
+
+
 # # views.py
 # @extend_schema(
 #     tags=["Users"],